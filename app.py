@@ -1,14 +1,154 @@
 import streamlit as st
-import pandas as pd
+import numpy as np
 from datetime import datetime
-import os
-import threading
 
 from modules.config import STOCK_POOLS
-from modules.data_loader import fetch_history_data, fetch_intraday_data_v2, background_prefetch_task, build_fetch_plan
+from modules.data_loader import SH_BOARDS, fetch_history_data, iter_intraday_days, submit_prefetch_job, prefetch_in_progress, stop_prefetch, build_fetch_plan, start_min_cache_migration, migrate_history_caches, clear_min_memory_cache, history_cache_exists, remove_history_cache, truncate_history_cache
 from modules.analysis import calculate_deviation_data, filter_deviation_data
 from modules.visualization import plot_market_heatmap, plot_deviation_scatter, plot_intraday_charts
-from modules.utils import add_script_run_ctx
+from modules.utils import slice_trading_day
+
+
+def get_available_dates(df, scope):
+    """
+    可选交易日列表 (及同序的 datetime64[D] 数组，供二分查找) 缓存在 session_state 中，
+    仅当数据行数或最新日期变化时才重新计算。
+    df 已按 日期 升序，直接在 datetime64[D] 数组上找日期变化点，
+    不生成逐行的 datetime.date 对象列。
+    """
+    signature = (scope, len(df), df['日期'].iat[-1])
+    cache_key = f"_available_dates_{scope}"
+    cached = st.session_state.get(cache_key)
+    if cached is not None and cached[0] == signature:
+        return cached[1], cached[2]
+    days = df['日期'].to_numpy().astype('datetime64[D]')
+    day_arr = days[np.r_[True, days[1:] != days[:-1]]] if days.size else days
+    dates = day_arr.tolist()
+    st.session_state[cache_key] = (signature, dates, day_arr)
+    return dates, day_arr
+
+
+def date_position(day_arr, day):
+    """在升序 datetime64[D] 数组中二分定位 day，返回 (插入位置, 是否恰好命中)。"""
+    key = np.datetime64(day, 'D')
+    pos = int(np.searchsorted(day_arr, key))
+    return pos, bool(pos < day_arr.size and day_arr[pos] == key)
+
+
+def dates_between(dates, day_arr, start, end):
+    """取 [start, end] 内的交易日，两端各二分一次后切片。"""
+    lo = np.searchsorted(day_arr, np.datetime64(start, 'D'), side='left')
+    hi = np.searchsorted(day_arr, np.datetime64(end, 'D'), side='right')
+    return dates[lo:hi]
+
+
+def top_k_positions(values, positions, k):
+    """
+    在 positions 指定的行里取 values 最大的 k 个，按降序返回行位置。
+    先 argpartition (O(N)) 选出候选，再只对这 k 个排序。
+    """
+    if k <= 0 or positions.size == 0:
+        return positions[:0]
+    sub = values[positions]
+    if k < sub.size:
+        part = np.argpartition(-sub, k - 1)[:k]
+    else:
+        part = np.arange(sub.size)
+    return positions[part[np.argsort(-sub[part], kind='stable')]]
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def compute_top_stocks(_daily_df, pool_name, date_key, chart_mode, filter_cyb, filter_kcb, top_n, df_sig):
+    """
+    沪/深各取 Top-N 标的，返回可哈希的 ((代码, 名称, 成交额), ...)。
+    _daily_df 不参与哈希，缓存由其余小参数决定；df_sig 在日线数据更新后变化以使缓存失效。
+    """
+    if "成交额" in chart_mode:
+        sort_key = _daily_df['成交额'].to_numpy(dtype=float)
+    else:
+        sort_key = np.abs(_daily_df['涨跌幅'].to_numpy(dtype=float) * _daily_df['成交额'].to_numpy(dtype=float))
+    sort_key = np.nan_to_num(sort_key, nan=-np.inf)
+
+    is_sh = _daily_df['board'].isin(SH_BOARDS).to_numpy()
+    top_pos = np.concatenate([
+        top_k_positions(sort_key, np.flatnonzero(is_sh), top_n),
+        top_k_positions(sort_key, np.flatnonzero(~is_sh), top_n)
+    ])
+    top_stocks_df = _daily_df.iloc[top_pos]
+    return tuple(zip(
+        top_stocks_df['代码'].tolist(),
+        top_stocks_df['名称'].tolist(),
+        top_stocks_df['成交额'].tolist()
+    ))
+
+
+@st.cache_data(ttl=3600, show_spinner=False, max_entries=16)
+def build_intraday_figures(_all_intraday_data, days_key, _daily_df, chart_mode, date_key, df_sig, intraday_sig):
+    """
+    分时叠加图的拼接、坐标换算与绘图只取决于所取数据本身，切换页签等 rerun 时直接复用。
+    intraday_sig 由 (代码, 是否指数, 日期, 行数, 最后时间) 组成，数据变化时缓存失效。
+    """
+    return plot_intraday_charts(_all_intraday_data, list(days_key), _daily_df, chart_mode)
+
+
+@st.fragment
+def render_divergence_strategy(div_df, market_median_chg):
+    """
+    偏离度页面的策略筛选与结果展示。作为 fragment 运行：切换策略时只重跑这一段，
+    不重新加载日线、不重新计算区间偏离度。
+    """
+    st.markdown("### 🔎 策略筛选")
+    strategy_mode = st.radio(
+        "选择筛选策略",
+        ["默认 (全部展示)", "🛡️ 护盘/控盘 (逆势大票)", "🔥 游资/活跃 (高换手/高波)", "☠️ 出货/砸盘 (放量下跌)"],
+        horizontal=True
+    )
+
+    filtered_div = filter_deviation_data(div_df, strategy_mode=strategy_mode)
+
+    col_m1, col_m2 = st.columns(2)
+    col_m1.metric("基准(中位数)涨跌幅", f"{market_median_chg:.2f}%")
+    col_m2.metric("当前策略筛选数量", f"{len(filtered_div)} 只")
+
+    st.divider()
+
+    if not filtered_div.empty:
+        fig_scatter = plot_deviation_scatter(filtered_div, strategy_mode)
+        if fig_scatter:
+            st.plotly_chart(fig_scatter, use_container_width=True)
+        else:
+            st.warning("当前策略下无符合条件的标的。")
+    else:
+        st.warning("当前策略下无符合条件的标的。")
+
+    col_list1, col_list2 = st.columns(2)
+
+    with col_list1:
+        st.subheader("🔥 资金抱团 (放量向上偏离)")
+        buy_df = filtered_div[filtered_div['偏离度'] > 0].sort_values('区间总成交', ascending=False).head(20)
+        st.dataframe(
+            buy_df[['代码', '名称', '偏离度', '成交额(亿)', '区间涨跌幅']],
+            column_config={
+                '偏离度': st.column_config.NumberColumn(format="%+.2f%%"),
+                '成交额(亿)': st.column_config.NumberColumn(format="%.1f"),
+                '区间涨跌幅': st.column_config.NumberColumn(format="%.2f%%")
+            },
+            hide_index=True
+        )
+
+    with col_list2:
+        st.subheader("📉 资金出逃 (放量向下偏离)")
+        sell_df = filtered_div[filtered_div['偏离度'] < 0].sort_values('区间总成交', ascending=False).head(20)
+        st.dataframe(
+            sell_df[['代码', '名称', '偏离度', '成交额(亿)', '区间涨跌幅']],
+            column_config={
+                '偏离度': st.column_config.NumberColumn(format="%.2f%%"),
+                '成交额(亿)': st.column_config.NumberColumn(format="%.1f"),
+                '区间涨跌幅': st.column_config.NumberColumn(format="%.2f%%")
+            },
+            hide_index=True
+        )
+
 
 st.set_page_config(
     page_title="A股资金全景分析",
@@ -16,6 +156,10 @@ st.set_page_config(
     layout="wide"
 )
 
+# 旧版单文件日线缓存 -> 分区数据集、旧版 parquet 分时缓存 -> feather，进程内只执行一次
+migrate_history_caches()
+start_min_cache_migration()
+
 with st.sidebar:
     st.header("⚙️ 核心设置")
 
@@ -37,13 +181,8 @@ with st.sidebar:
                 p_cfg = STOCK_POOLS[selected_pool]
                 c_path = p_cfg["cache"]
 
-                if os.path.exists(c_path):
-                    _df = pd.read_parquet(c_path)
-                    if not _df.empty:
-                        _df['日期'] = pd.to_datetime(_df['日期'])
-                    _today = datetime.now().date()
-                    _df_new = _df[_df['日期'].dt.date < _today]
-                    _df_new.to_parquet(c_path)
+                if history_cache_exists(c_path):
+                    truncate_history_cache(c_path, datetime.now().date())
                     st.toast(f"已清除 [{selected_pool}] 今日缓存，正在重新同步...")
                 else:
                     st.toast(f"[{selected_pool}] 暂无本地缓存，直接刷新...")
@@ -53,15 +192,16 @@ with st.sidebar:
             except Exception as e:
                 st.error(f"操作失败: {e}")
 
-        if st.button("🧹 清空分时图缓存"):
+        if st.button("🧹 清空内存缓存"):
             st.cache_data.clear()
-            st.toast("✅ 所有内存缓存已清空，下次查看分时图将重新下载。")
+            clear_min_memory_cache()
+            st.toast("✅ 内存缓存已清空，下次查看分时图将重新读取本地缓存文件 (磁盘缓存保留)。")
 
         if st.button(f"🚨 重置 [{selected_pool}] 历史数据"):
             p_cfg = STOCK_POOLS[selected_pool]
             c_path = p_cfg["cache"]
-            if os.path.exists(c_path):
-                os.remove(c_path)
+            if history_cache_exists(c_path):
+                remove_history_cache(c_path)
                 st.toast(f"已删除 [{selected_pool}] 本地历史文件。")
             st.cache_data.clear()
             st.rerun()
@@ -69,14 +209,13 @@ with st.sidebar:
         if st.checkbox("显示高级选项 (全局重置)", key="show_advanced_reset"):
             if st.button("💣 毁灭吧赶紧的 (删除所有池数据)"):
                 for p_name, p_val in STOCK_POOLS.items():
-                    if os.path.exists(p_val["cache"]):
-                        os.remove(p_val["cache"])
+                    remove_history_cache(p_val["cache"])
                 st.cache_data.clear()
                 st.rerun()
 
     st.markdown("---")
     st.markdown("### 🛠️ 板块过滤")
-    filter_cyb = st.checkbox("屏蔽创业板 (300开头)", value=False)
+    filter_cyb = st.checkbox("屏蔽创业板 (30开头)", value=False)
     filter_kcb = st.checkbox("屏蔽科创板 (688开头)", value=True)
 
     st.markdown("---")
@@ -118,7 +257,7 @@ if allow_download:
                 est_text = "未知"
             plan_lines = [
                 f"指数池: {plan['pool_name']} (代码 {plan['index_code']})",
-                f"缓存文件: {plan['cache_file']}",
+                f"缓存目录: {plan['cache_dir']}",
                 f"已有缓存: {'是' if plan['has_cache'] else '否'} | 记录数 {plan['cached_rows']}",
                 f"拉取区间: {plan['start_date_str']} - {plan['end_date_str']}",
                 "接口说明:",
@@ -159,34 +298,24 @@ if allow_download:
         st.session_state[confirm_key] = False
 
 # --- 后台任务检测与控制 ---
-bg_thread = None
-for t in threading.enumerate():
-    if t.name == "PrefetchWorker":
-        bg_thread = t
-        break
-
 with st.sidebar:
     st.markdown("---")
     with st.expander("📥 后台数据预取", expanded=False):
         st.caption("后台静默下载最近 N 天分时数据")
         prefetch_days = st.number_input("预取天数", min_value=5, max_value=200, value=30, step=10)
 
-        if bg_thread and bg_thread.is_alive():
+        if prefetch_in_progress():
             st.info("🟢 后台任务运行中...\n请关注控制台日志")
+            if st.button("⏹️ 停止后台下载"):
+                stop_prefetch()
+                st.rerun()
         else:
             if st.button("🚀 启动后台下载"):
                 if not origin_df.empty:
-                    all_dates = sorted(origin_df['日期'].dt.date.unique())
+                    all_dates, _ = get_available_dates(origin_df, f"origin_{selected_pool}")
                     target_prefetch_dates = all_dates[-prefetch_days:]
 
-                    t = threading.Thread(
-                        target=background_prefetch_task,
-                        args=(target_prefetch_dates, origin_df),
-                        name="PrefetchWorker",
-                        daemon=True
-                    )
-                    add_script_run_ctx(t)
-                    t.start()
+                    submit_prefetch_job(target_prefetch_dates, origin_df)
                     st.rerun()
                 else:
                     st.error("历史数据尚未就绪")
@@ -201,12 +330,12 @@ if origin_df.empty:
         st.error("数据加载失败，请刷新重试。")
     st.stop()
 
-# 全局过滤
-filtered_df = origin_df.copy()
-if filter_cyb:
-    filtered_df = filtered_df[~filtered_df['代码'].astype(str).str.startswith('300')]
-if filter_kcb:
-    filtered_df = filtered_df[~filtered_df['代码'].astype(str).str.startswith('688')]
+# 全局过滤：下游只读，不勾选时直接复用 origin_df，不做整表拷贝
+excluded_boards = [b for b, on in (('CYB', filter_cyb), ('KCB', filter_kcb)) if on]
+if excluded_boards:
+    filtered_df = origin_df[~origin_df['board'].isin(excluded_boards)]
+else:
+    filtered_df = origin_df
 
 if filtered_df.empty:
     st.warning("过滤后没有剩余股票数据，请取消勾选过滤选项。")
@@ -221,7 +350,7 @@ if nav_option == "📊 盘面回放":
         "> 3. 观察当日盘面的资金流向与热度。"
     )
 
-    available_dates = sorted(filtered_df['日期'].dt.date.unique())
+    available_dates, available_days = get_available_dates(filtered_df, f"filtered_{selected_pool}_{filter_cyb}_{filter_kcb}")
     today = datetime.now().date()
     last_available_date = available_dates[-1]
 
@@ -234,15 +363,18 @@ if nav_option == "📊 盘面回放":
     if date_override_key not in st.session_state:
         st.session_state[date_override_key] = None
     if date_init_key not in st.session_state:
-        if today in available_dates:
-            st.session_state[date_idx_key] = available_dates.index(today)
+        today_pos, today_found = date_position(available_days, today)
+        if today_found:
+            st.session_state[date_idx_key] = today_pos
         else:
             st.session_state[date_override_key] = today
         st.session_state[date_init_key] = True
 
-    if st.session_state[date_override_key] in available_dates:
-        st.session_state[date_idx_key] = available_dates.index(st.session_state[date_override_key])
-        st.session_state[date_override_key] = None
+    if st.session_state[date_override_key] is not None:
+        override_pos, override_found = date_position(available_days, st.session_state[date_override_key])
+        if override_found:
+            st.session_state[date_idx_key] = override_pos
+            st.session_state[date_override_key] = None
 
     if st.session_state[date_idx_key] >= len(available_dates):
         st.session_state[date_idx_key] = len(available_dates) - 1
@@ -264,10 +396,9 @@ if nav_option == "📊 盘面回放":
             st.write("")
             st.write("")
             if st.button("前一天"):
-                prev_dates = [d for d in available_dates if d < current_date_val]
-                if prev_dates:
-                    prev_date = prev_dates[-1]
-                    st.session_state[date_idx_key] = available_dates.index(prev_date)
+                cur_pos, _ = date_position(available_days, current_date_val)
+                if cur_pos > 0:
+                    st.session_state[date_idx_key] = cur_pos - 1
                     st.session_state[date_override_key] = None
                     st.rerun()
                 else:
@@ -277,10 +408,10 @@ if nav_option == "📊 盘面回放":
             st.write("")
             st.write("")
             if st.button("后一天"):
-                next_dates = [d for d in available_dates if d > current_date_val]
-                if next_dates:
-                    next_date = next_dates[0]
-                    st.session_state[date_idx_key] = available_dates.index(next_date)
+                cur_pos, cur_found = date_position(available_days, current_date_val)
+                next_pos = cur_pos + 1 if cur_found else cur_pos
+                if next_pos < len(available_dates):
+                    st.session_state[date_idx_key] = next_pos
                     st.session_state[date_override_key] = None
                     st.rerun()
                 else:
@@ -297,8 +428,9 @@ if nav_option == "📊 盘面回放":
             )
 
             if picked_date != current_date_val:
-                if picked_date in available_dates:
-                    st.session_state[date_idx_key] = available_dates.index(picked_date)
+                picked_pos, picked_found = date_position(available_days, picked_date)
+                if picked_found:
+                    st.session_state[date_idx_key] = picked_pos
                     st.session_state[date_override_key] = None
                 else:
                     st.session_state[date_override_key] = picked_date
@@ -322,7 +454,7 @@ if nav_option == "📊 盘面回放":
 
         if len(date_range) == 2:
             start_d, end_d = date_range
-            target_dates = [d for d in available_dates if start_d <= d <= end_d]
+            target_dates = dates_between(available_dates, available_days, start_d, end_d)
             if end_d > last_available_date:
                 st.warning(f"结束日期超出已缓存日期，当前仅展示到 {last_available_date}。")
                 if st.button("拉取最新数据", key="fetch_latest_range"):
@@ -345,7 +477,7 @@ if nav_option == "📊 盘面回放":
         st.session_state["show_intraday"] = False
         st.session_state[last_date_key] = selected_date
 
-    daily_df = filtered_df[filtered_df['日期'].dt.date == selected_date].copy()
+    daily_df = slice_trading_day(filtered_df, selected_date)
 
     if daily_df.empty:
         st.warning(f"{selected_date} 当日无交易数据（可能是非交易日或数据缺失）。")
@@ -390,23 +522,10 @@ if nav_option == "📊 盘面回放":
         if show_intraday:
             progress_area = st.empty()
 
-            if "成交额" in chart_mode:
-                sort_col = '成交额'
-            else:
-                daily_df['abs_impact'] = (daily_df['涨跌幅'] * daily_df['成交额']).abs()
-                sort_col = 'abs_impact'
-
-            sh_pool = daily_df[daily_df['代码'].astype(str).str.startswith('6')].copy()
-            sz_pool = daily_df[~daily_df['代码'].astype(str).str.startswith('6')].copy()
-
-            sh_top = sh_pool.sort_values(sort_col, ascending=False).head(top_n)
-            sz_top = sz_pool.sort_values(sort_col, ascending=False).head(top_n)
-
-            top_stocks_df = pd.concat([sh_top, sz_top], ignore_index=True)
-
-            target_stocks_list = []
-            for _, row in top_stocks_df.iterrows():
-                target_stocks_list.append((row['代码'], row['名称'], row['成交额']))
+            df_sig = f"{len(origin_df)}_{origin_df['日期'].iloc[-1]}"
+            target_stocks_list = list(compute_top_stocks(
+                daily_df, selected_pool, str(selected_date), chart_mode, filter_cyb, filter_kcb, top_n, df_sig
+            ))
 
             all_intraday_data = []
             period_to_use = '1'
@@ -427,23 +546,30 @@ if nav_option == "📊 盘面回放":
             status_text = st.empty()
             fetch_progress = st.progress(0)
 
-            for i, d_date in enumerate(target_dates_to_fetch):
-                status_text.text(f"🔄 正在获取: {d_date.strftime('%Y-%m-%d')} ({i+1}/{total_steps})...")
-                fetch_progress.progress((i + 1) / total_steps)
-
-                d_str = d_date.strftime("%Y-%m-%d")
-                day_results = fetch_intraday_data_v2(
-                    target_stocks_list,
-                    d_str,
-                    period=period_to_use,
-                    max_workers=max_workers,
-                    request_delay=request_delay
-                )
-
+            date_by_str = {d.strftime("%Y-%m-%d"): d for d in target_dates_to_fetch}
+            status_text.text(f"🔄 正在获取 {total_steps} 个交易日的分时数据...")
+            day_iter = iter_intraday_days(
+                target_stocks_list,
+                list(date_by_str),
+                period=period_to_use,
+                max_workers=max_workers,
+                request_delay=request_delay
+            )
+            # 每次更新进度都是一次前端往返，日期多时只按约 5% 的步长刷新
+            update_every = max(1, total_steps // 20)
+            fetched_days = set()
+            for i, (d_str, day_results) in enumerate(day_iter):
+                if i % update_every == 0 or i == total_steps - 1:
+                    status_text.text(f"🔄 已完成: {d_str} ({i+1}/{total_steps})...")
+                    fetch_progress.progress((i + 1) / total_steps)
+
+                d_date = date_by_str[d_str]
                 for res in day_results:
                     res['data']['date_col'] = d_str
                     res['real_date'] = d_date
 
+                if day_results:
+                    fetched_days.add(d_str)
                 all_intraday_data.extend(day_results)
 
             status_text.empty()
@@ -453,16 +579,16 @@ if nav_option == "📊 盘面回放":
             if not all_intraday_data:
                 st.warning("未能获取到分时数据")
             else:
-                valid_dates = set()
-                for item in all_intraday_data:
-                    if 'real_date' in item:
-                        valid_dates.add(item['real_date'].strftime("%Y-%m-%d"))
-
-                days_list = sorted(list(valid_dates))
-                if not days_list:
-                    days_list = sorted(list(set([x.strftime("%Y-%m-%d") for x in target_dates_to_fetch])))
-
-                fig_sh, fig_sz = plot_intraday_charts(all_intraday_data, days_list, daily_df, chart_mode)
+                # 有数据的交易日在取数循环里按天记录 (d_str 已是 YYYY-MM-DD)，不再逐条结果 strftime
+                days_list = sorted(fetched_days) or sorted(date_by_str)
+
+                intraday_sig = tuple(sorted(
+                    (item['code'], item['is_index'], item['data']['date_col'].iat[0], len(item['data']), str(item['data']['time'].iat[-1]))
+                    for item in all_intraday_data if not item['data'].empty
+                ))
+                fig_sh, fig_sz = build_intraday_figures(
+                    all_intraday_data, tuple(days_list), daily_df, chart_mode, str(selected_date), df_sig, intraday_sig
+                )
 
                 tab1, tab2 = st.tabs(["沪市 (SH)", "深市 (SZ)"])
                 with tab1:
@@ -478,11 +604,12 @@ if nav_option == "📊 盘面回放":
 
         with st.expander("查看当日详细数据"):
             st.dataframe(
-                daily_df[['代码', '名称', '收盘', '涨跌幅', '成交额']].style.format({
-                    '收盘': '{:.2f}',
-                    '涨跌幅': '{:.2f}%',
-                    '成交额': '{:,.0f}'
-                }),
+                daily_df[['代码', '名称', '收盘', '涨跌幅', '成交额']],
+                column_config={
+                    '收盘': st.column_config.NumberColumn(format="%.2f"),
+                    '涨跌幅': st.column_config.NumberColumn(format="%.2f%%"),
+                    '成交额': st.column_config.NumberColumn(format="%,d")
+                },
                 hide_index=True
             )
 
@@ -490,7 +617,7 @@ elif nav_option == "🌊 资金偏离分析":
     st.subheader("🌊 资金偏离度分析 (Alpha Divergence)")
     st.info("💡 **逻辑说明**：计算选定周期内每只股票相对于【市场中位数】的超额涨跌幅（偏离度）。\n\n如果某只股票 **成交额巨大** 且 **向下偏离极大**，通常意味着主力资金在大举出货；反之则是主力抢筹。")
 
-    available_dates = sorted(filtered_df['日期'].dt.date.unique())
+    available_dates, available_days = get_available_dates(filtered_df, f"filtered_{selected_pool}_{filter_cyb}_{filter_kcb}")
     col_d1, col_d2 = st.columns(2)
     with col_d1:
         date_range_div = st.date_input(
@@ -504,7 +631,7 @@ elif nav_option == "🌊 资金偏离分析":
     target_dates_div = []
     if len(date_range_div) == 2:
         s_d, e_d = date_range_div
-        target_dates_div = [d for d in available_dates if s_d <= d <= e_d]
+        target_dates_div = dates_between(available_dates, available_days, s_d, e_d)
 
     if not target_dates_div:
         st.warning("请选择有效的时间范围")
@@ -517,52 +644,4 @@ elif nav_option == "🌊 资金偏离分析":
     if div_df.empty:
         st.stop()
 
-    st.markdown("### 🔎 策略筛选")
-    strategy_mode = st.radio(
-        "选择筛选策略",
-        ["默认 (全部展示)", "🛡️ 护盘/控盘 (逆势大票)", "🔥 游资/活跃 (高换手/高波)", "☠️ 出货/砸盘 (放量下跌)"],
-        horizontal=True
-    )
-
-    filtered_div = filter_deviation_data(div_df, strategy_mode=strategy_mode)
-
-    col_m1, col_m2 = st.columns(2)
-    col_m1.metric("基准(中位数)涨跌幅", f"{market_median_chg:.2f}%")
-    col_m2.metric("当前策略筛选数量", f"{len(filtered_div)} 只")
-
-    st.divider()
-
-    if not filtered_div.empty:
-        fig_scatter = plot_deviation_scatter(filtered_div, strategy_mode)
-        if fig_scatter:
-            st.plotly_chart(fig_scatter, use_container_width=True)
-        else:
-            st.warning("当前策略下无符合条件的标的。")
-    else:
-        st.warning("当前策略下无符合条件的标的。")
-
-    col_list1, col_list2 = st.columns(2)
-
-    with col_list1:
-        st.subheader("🔥 资金抱团 (放量向上偏离)")
-        buy_df = filtered_div[filtered_div['偏离度'] > 0].sort_values('区间总成交', ascending=False).head(20)
-        st.dataframe(
-            buy_df[['代码', '名称', '偏离度', '成交额(亿)', '区间涨跌幅']].style.format({
-                '偏离度': '+{:.2f}%',
-                '成交额(亿)': '{:.1f}',
-                '区间涨跌幅': '{:.2f}%'
-            }),
-            hide_index=True
-        )
-
-    with col_list2:
-        st.subheader("📉 资金出逃 (放量向下偏离)")
-        sell_df = filtered_div[filtered_div['偏离度'] < 0].sort_values('区间总成交', ascending=False).head(20)
-        st.dataframe(
-            sell_df[['代码', '名称', '偏离度', '成交额(亿)', '区间涨跌幅']].style.format({
-                '偏离度': '{:.2f}%',
-                '成交额(亿)': '{:.1f}',
-                '区间涨跌幅': '{:.2f}%'
-            }),
-            hide_index=True
-        )
+    render_divergence_strategy(div_df, market_median_chg)
@@ -1,5 +1,8 @@
+import numpy as np
 import pandas as pd
 
+from .utils import slice_date_range
+
 def calculate_deviation_data(df, target_dates):
     """
     计算资金偏离度数据
@@ -10,49 +13,53 @@ def calculate_deviation_data(df, target_dates):
     start_date_ts = pd.Timestamp(target_dates[0])
     end_date_ts = pd.Timestamp(target_dates[-1])
     
-    div_period_df = df[(df['日期'] >= start_date_ts) & (df['日期'] <= end_date_ts)].copy()
+    # 日期列已升序，二分定位区间，避免整表布尔掩码 + copy
+    div_period_df = slice_date_range(df, start_date_ts, end_date_ts)
     
     if div_period_df.empty:
         return pd.DataFrame(), 0.0
 
-    div_stats = []
-    grouped = div_period_df.groupby('代码')
-    
-    for code, group in grouped:
-        group = group.sort_values('日期')
-        if group.empty: continue
-        
-        first_row = group.iloc[0]
-        last_row = group.iloc[-1]
-        
-        try:
-            # 估算区间涨幅
-            s_open = first_row['收盘'] / (1 + first_row['涨跌幅']/100)
-            e_close = last_row['收盘']
-            
-            # Protect against division by zero
-            if s_open == 0: continue
-            
-            cum_pct = (e_close - s_open) / s_open * 100
-            total_to = group['成交额'].sum()
-            
-            div_stats.append({
-                '代码': code,
-                '名称': first_row['名称'],
-                '区间涨跌幅': cum_pct,
-                '区间总成交': total_to
-            })
-        except:
-            pass
-            
-    div_df = pd.DataFrame(div_stats)
+    # 日期已升序：按代码做稳定排序即得到 (代码, 日期) 顺序，每只股票占一段连续区间，
+    # 首/末行与区间成交额直接按区间边界取，不走 groupby
+    code_col = div_period_df['代码']
+    if isinstance(code_col.dtype, pd.CategoricalDtype):
+        code_ids = code_col.cat.codes.to_numpy()
+    else:
+        code_ids = pd.factorize(code_col)[0]
+    order = np.argsort(code_ids, kind='stable')
+    sorted_ids = code_ids[order]
+    starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+    ends = np.r_[starts[1:], len(order)] - 1
+
+    close = div_period_df['收盘'].to_numpy(dtype=np.float64)[order]
+    chg = div_period_df['涨跌幅'].to_numpy(dtype=np.float64)[order]
+    amount = div_period_df['成交额'].to_numpy(dtype=np.float64)[order]
+    first_pos = order[starts]
+
+    # 估算区间涨幅
+    s_open = close[starts] / (1 + chg[starts] / 100)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cum_pct = (close[ends] - s_open) / s_open * 100
+
+    div_stats = pd.DataFrame({
+        '代码': code_col.to_numpy()[first_pos],
+        '名称': div_period_df['名称'].to_numpy()[first_pos],
+        '区间涨跌幅': cum_pct,
+        '区间总成交': np.add.reduceat(amount, starts)
+    })
+    # Protect against division by zero
+    div_stats = div_stats[s_open != 0]
+
+    div_df = div_stats.reset_index(drop=True)
     if div_df.empty:
         return pd.DataFrame(), 0.0
         
     # 计算偏离度
     market_median_chg = div_df['区间涨跌幅'].median()
-    div_df['偏离度'] = div_df['区间涨跌幅'] - market_median_chg
-    div_df['成交额(亿)'] = div_df['区间总成交'] / 1e8
+    # 中位数按 float64 求出后，展示/绘图列收窄为 float32，散点图的二进制数组随之减半
+    div_df['偏离度'] = (div_df['区间涨跌幅'] - market_median_chg).astype(np.float32)
+    div_df['区间涨跌幅'] = div_df['区间涨跌幅'].astype(np.float32)
+    div_df['成交额(亿)'] = (div_df['区间总成交'] / 1e8).astype(np.float32)
     
     return div_df, market_median_chg
 
@@ -1,14 +1,28 @@
+import numpy as np
 import pandas as pd
 import akshare as ak
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.fs as pa_fs
+import pyarrow.parquet as pq
 import os
+import shutil
 import streamlit as st
 import concurrent.futures
+import hashlib
+import queue
 import threading
+from collections import OrderedDict, namedtuple
 from datetime import datetime, timedelta
 import time
 
 from .config import STOCK_POOLS, DATA_DIR
-from .utils import with_retry, get_start_date, add_script_run_ctx, get_script_run_ctx
+from .utils import (
+    with_retry, get_start_date, add_script_run_ctx, get_script_run_ctx, slice_trading_day,
+    RateLimiter, backoff_delay, retry_after_seconds, is_transient_error
+)
 
 
 def log_info(message):
@@ -37,6 +51,12 @@ def _disable_proxy_env():
     return True
 
 
+def _bind_script_run_ctx(ctx):
+    """线程池 initializer：每个工作线程只绑定一次 Streamlit 上下文。"""
+    if ctx:
+        add_script_run_ctx(threading.current_thread(), ctx)
+
+
 def _stop_requested():
     try:
         return bool(st.session_state.get("stop_fetch_requested"))
@@ -44,6 +64,324 @@ def _stop_requested():
         return False
 
 
+# 界面与分析实际用到的日线列；读缓存时只投影这些列
+HISTORY_COLUMNS = ['日期', '代码', '名称', '收盘', '涨跌幅', '成交额']
+
+
+# 日线数值列的目标类型：价格/涨跌幅用 float32 足够，成交额求和需保留 float64
+_HISTORY_NUMERIC_TYPES = {
+    '涨跌幅': pa.float32(),
+    '成交额': pa.float64(),
+    '收盘': pa.float32(),
+}
+
+
+def _cast_numeric_columns(df, column_types):
+    """
+    用 Arrow 的向量化 cast 把数值列转成目标类型。
+    列中混有无法解析的文本时回退到 pd.to_numeric(errors='coerce')。
+    """
+    for col, arrow_type in column_types.items():
+        try:
+            arr = pa.array(df[col], from_pandas=True)
+            df[col] = pc.cast(arr, arrow_type, safe=False).to_numpy(zero_copy_only=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(arrow_type.to_pandas_dtype())
+    return df
+
+
+def _build_spot_today_rows(new_df, codes, today_spot_map, stock_names, end_date_str):
+    """
+    为今日日线缺失的标的一次性构建 spot 补全行，
+    替代在每只股票的拉取线程里各自构造单行 DataFrame。
+    """
+    today_ts = pd.to_datetime(end_date_str)
+    have_today = set()
+    if not new_df.empty:
+        have_today = set(new_df.loc[new_df['日期'] == today_ts, '代码'])
+    missing_today = [c for c in codes if c not in have_today and c in today_spot_map]
+    if not missing_today:
+        return pd.DataFrame()
+    spot_rows = pd.DataFrame.from_dict({c: today_spot_map[c] for c in missing_today}, orient='index')
+    return pd.DataFrame({
+        '日期': today_ts,
+        '收盘': spot_rows['最新价'].to_numpy(),
+        '涨跌幅': spot_rows['涨跌幅'].to_numpy(),
+        '成交额': spot_rows['成交额'].to_numpy(),
+        '代码': missing_today,
+        '名称': [stock_names.get(c, c) for c in missing_today],
+    })
+
+
+# 每个行组大约覆盖的交易日数；按日期排序后行组的 min/max 统计可用于日期过滤下推
+_HISTORY_ROW_GROUP_DAYS = 20
+# 日线缓存按年份分区 (hive: year=2025/...)，增量保存只追加新的小文件
+_HISTORY_PARTITIONING = ds.partitioning(pa.schema([("year", pa.int16())]), flavor="hive")
+# 单个年份分区的增量文件超过该数量时合并为一个文件
+_HISTORY_COMPACT_PARTS = 24
+
+
+def _history_dataset_dir(cache_file):
+    """配置中的 cache 仍是旧版单文件路径，分区数据集目录由其去掉扩展名得到。"""
+    return os.path.splitext(cache_file)[0]
+
+
+# 日线分区文件的写出参数，数据集写出与单分区重写共用同一份
+# 日期单调递增，DELTA 编码比 PLAIN 更紧凑；浮点列实测 BYTE_STREAM_SPLIT 反而更大，保持默认
+_HISTORY_WRITE_OPTIONS = dict(
+    compression='zstd',
+    compression_level=3,
+    use_dictionary=['代码', '名称'],
+    column_encoding={'日期': 'DELTA_BINARY_PACKED'},
+    data_page_version='2.0',
+    write_statistics=True
+)
+
+
+def _history_file_options():
+    return ds.ParquetFileFormat().make_write_options(**_HISTORY_WRITE_OPTIONS)
+
+
+def _write_history_parts(target_dir, df, tag):
+    """把 df 按年份分区写到 target_dir，行按 (日期, 代码) 排序。"""
+    df = df[HISTORY_COLUMNS].sort_values(['日期', '代码'], kind='mergesort')
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.append_column('year', pc.cast(pc.year(table['日期']), pa.int16()))
+    rows_per_group = max(1, df['代码'].nunique()) * _HISTORY_ROW_GROUP_DAYS
+    ds.write_dataset(
+        table,
+        target_dir,
+        format='parquet',
+        partitioning=_HISTORY_PARTITIONING,
+        basename_template=f"part-{tag}-{{i}}.parquet",
+        existing_data_behavior='overwrite_or_ignore',
+        file_options=_history_file_options(),
+        min_rows_per_group=rows_per_group,
+        max_rows_per_group=rows_per_group
+    )
+
+
+def _replace_dir(src_dir, dst_dir):
+    old_dir = dst_dir + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(dst_dir):
+        os.replace(dst_dir, old_dir)
+    os.replace(src_dir, dst_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def _migrate_legacy_history_cache(cache_file):
+    """
+    旧版单文件缓存 -> 年份分区数据集，只在数据集目录不存在时执行，重复调用无副作用。
+    旧文件原样保留 (不再被读取)，只有“重置历史数据”才会删除。
+    """
+    if not os.path.isfile(cache_file) or os.path.isdir(_history_dataset_dir(cache_file)):
+        return
+    available = set(pq.read_schema(cache_file).names)
+    df = pd.read_parquet(cache_file, columns=[c for c in HISTORY_COLUMNS if c in available])
+    write_history_cache(cache_file, df)
+    log_info(f"已迁移日线缓存为分区数据集: {_history_dataset_dir(cache_file)}")
+
+
+_HISTORY_MIGRATION_LOCK = threading.Lock()
+_HISTORY_MIGRATION_DONE = False
+
+
+def migrate_history_caches():
+    """
+    启动时执行一次：把各指数池的旧版单文件日线缓存迁移为分区数据集。
+    进程内只执行一次，Streamlit 重跑脚本时重复调用无副作用。
+    """
+    global _HISTORY_MIGRATION_DONE
+    with _HISTORY_MIGRATION_LOCK:
+        if _HISTORY_MIGRATION_DONE:
+            return
+        for config in STOCK_POOLS.values():
+            try:
+                _migrate_legacy_history_cache(config["cache"])
+            except Exception as e:
+                log_info(f"日线缓存迁移失败: {config['cache']} | {e}")
+        _HISTORY_MIGRATION_DONE = True
+
+
+def history_cache_exists(cache_file):
+    dataset_dir = _history_dataset_dir(cache_file)
+    if not os.path.isdir(dataset_dir):
+        return False
+    for _, _, files in os.walk(dataset_dir):
+        if any(f.endswith(".parquet") for f in files):
+            return True
+    return False
+
+
+def remove_history_cache(cache_file):
+    shutil.rmtree(_history_dataset_dir(cache_file), ignore_errors=True)
+    if os.path.isfile(cache_file):
+        os.remove(cache_file)
+
+
+def _open_history_dataset(cache_file):
+    """
+    打开分区数据集：本地文件走 mmap，代码/名称 直接按字典列读出 (pandas 中为 category)，
+    不必为每一行物化一个 Python 字符串。
+    """
+    file_format = ds.ParquetFileFormat(
+        read_options=ds.ParquetReadOptions(dictionary_columns=['代码', '名称'])
+    )
+    return ds.dataset(
+        _history_dataset_dir(cache_file),
+        format=file_format,
+        partitioning=_HISTORY_PARTITIONING,
+        filesystem=pa_fs.LocalFileSystem(use_mmap=True)
+    )
+
+
+def read_history_cache(cache_file, columns=HISTORY_COLUMNS):
+    """
+    按列投影读取日线缓存，不加载界面用不到的列。
+    """
+    dataset = _open_history_dataset(cache_file)
+    columns = [c for c in columns if c in dataset.schema.names]
+    df = dataset.to_table(columns=columns, use_threads=True).to_pandas(self_destruct=True)
+    if '日期' in df.columns and not df['日期'].is_monotonic_increasing:
+        df = df.sort_values('日期', kind='mergesort', ignore_index=True)
+    return df
+
+
+def history_cache_summary(cache_file):
+    """
+    只读各分片的 Parquet footer，返回 (行数, 最早日期, 最新日期)，不解码任何数据页。
+    缺少统计信息时退回到只读 日期 一列。
+    """
+    dataset = _open_history_dataset(cache_file)
+    rows, lo, hi = 0, None, None
+    for fragment in dataset.get_fragments():
+        metadata = fragment.metadata
+        rows += metadata.num_rows
+        col_idx = metadata.schema.to_arrow_schema().get_field_index('日期')
+        for i in range(metadata.num_row_groups):
+            stats = metadata.row_group(i).column(col_idx).statistics
+            if stats is None or not stats.has_min_max:
+                dates = dataset.to_table(columns=['日期'])['日期']
+                bounds = pc.min_max(dates).as_py()
+                return len(dates), bounds['min'], bounds['max']
+            lo = stats.min if lo is None else min(lo, stats.min)
+            hi = stats.max if hi is None else max(hi, stats.max)
+    return rows, lo, hi
+
+
+def write_history_cache(cache_file, df):
+    """
+    全量写入日线历史缓存：先写到临时目录再整体替换，
+    避免中途失败或并发读取时留下半截数据。
+    """
+    dataset_dir = _history_dataset_dir(cache_file)
+    tmp_dir = dataset_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    _write_history_parts(tmp_dir, df, "base")
+    _replace_dir(tmp_dir, dataset_dir)
+
+
+def append_history_cache(cache_file, new_df):
+    """
+    增量保存：只把新行写成各年份分区下的新文件，写入量与新增行数成正比。
+    调用方需保证 new_df 与已有数据不重叠。
+    """
+    dataset_dir = _history_dataset_dir(cache_file)
+    tag = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    tmp_dir = f"{dataset_dir}.append-{tag}"
+    _write_history_parts(tmp_dir, new_df, tag)
+    # 逐个文件原子移动到正式目录
+    for root, _, files in os.walk(tmp_dir):
+        for name in files:
+            rel_dir = os.path.relpath(root, tmp_dir)
+            os.makedirs(os.path.join(dataset_dir, rel_dir), exist_ok=True)
+            os.replace(os.path.join(root, name), os.path.join(dataset_dir, rel_dir, name))
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    for year in new_df['日期'].dt.year.unique():
+        _compact_history_partition(dataset_dir, int(year))
+
+
+def _compact_history_partition(dataset_dir, year):
+    part_dir = os.path.join(dataset_dir, f"year={year}")
+    files = sorted(f for f in os.listdir(part_dir) if f.endswith(".parquet"))
+    if len(files) <= _HISTORY_COMPACT_PARTS:
+        return
+    table = ds.dataset([os.path.join(part_dir, f) for f in files], format="parquet").to_table()
+    _rewrite_history_partition(part_dir, files, table, "compact")
+    log_info(f"已合并日线缓存分区: year={year} | 文件数 {len(files)}")
+
+
+def _rewrite_history_partition(part_dir, old_files, table, tag):
+    """
+    用 Arrow 表 table 替换分区内的 old_files：先写临时文件再原子改名，最后删除旧文件。
+    全程在 Arrow 内排序与写出，不经过 pandas。
+    """
+    table = table.select(HISTORY_COLUMNS).sort_by([('日期', 'ascending'), ('代码', 'ascending')])
+    tmp_path = os.path.join(part_dir, f".{tag}.tmp")
+    pq.write_table(
+        table,
+        tmp_path,
+        row_group_size=max(1, pc.count_distinct(table['代码']).as_py()) * _HISTORY_ROW_GROUP_DAYS,
+        **_HISTORY_WRITE_OPTIONS
+    )
+    new_name = f"part-{tag}-{datetime.now().strftime('%Y%m%d%H%M%S%f')}-0.parquet"
+    os.replace(tmp_path, os.path.join(part_dir, new_name))
+    for f in old_files:
+        os.remove(os.path.join(part_dir, f))
+
+
+def truncate_history_cache(cache_file, before):
+    """
+    删除 日期 >= before 的日线缓存行，返回删除的行数。
+    先看 footer 统计的最新日期，没有需要删除的数据时不读任何数据页；
+    否则只重写受影响的年份分区，过滤由 Arrow 扫描完成，保留的行不转成 pandas。
+    """
+    if not history_cache_exists(cache_file):
+        return 0
+    _, _, max_date = history_cache_summary(cache_file)
+    before_ts = pd.Timestamp(before)
+    if max_date is None or pd.Timestamp(max_date) < before_ts:
+        return 0
+    dataset_dir = _history_dataset_dir(cache_file)
+    removed = 0
+    for year in range(before_ts.year, pd.Timestamp(max_date).year + 1):
+        part_dir = os.path.join(dataset_dir, f"year={year}")
+        if not os.path.isdir(part_dir):
+            continue
+        files = sorted(f for f in os.listdir(part_dir) if f.endswith(".parquet"))
+        if not files:
+            continue
+        part = ds.dataset([os.path.join(part_dir, f) for f in files], format="parquet")
+        total = part.count_rows()
+        cutoff = pa.scalar(before_ts, type=part.schema.field('日期').type)
+        keep = part.to_table(filter=ds.field('日期') < cutoff)
+        removed += total - keep.num_rows
+        if keep.num_rows == 0:
+            shutil.rmtree(part_dir)
+        elif keep.num_rows < total:
+            _rewrite_history_partition(part_dir, files, keep, "trunc")
+    return removed
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _index_constituent_count(index_code):
+    """
+    成分股数量只用于估算耗时。开启自动拉取后每次 rerun 都会生成拉取计划，
+    缓存一小时，避免每次都请求 index_stock_cons。取不到时抛异常，失败结果不会被缓存。
+    """
+    cons_df = with_retry(lambda: ak.index_stock_cons(symbol=index_code), retries=3, delay=1.0)
+    if cons_df is None or cons_df.empty:
+        raise ValueError(f"成分股列表为空: {index_code}")
+    if 'variety' in cons_df.columns:
+        code_col = 'variety'
+    elif '品种代码' in cons_df.columns:
+        code_col = '品种代码'
+    else:
+        code_col = cons_df.columns[0]
+    return len(cons_df[code_col].tolist())
+
+
 def build_fetch_plan(pool_name, max_workers, request_delay, fetch_spot):
     _disable_proxy_env()
 
@@ -51,18 +389,17 @@ def build_fetch_plan(pool_name, max_workers, request_delay, fetch_spot):
     cache_file = config["cache"]
     index_code = config["code"]
 
-    cached_df = pd.DataFrame()
     last_cached_date = None
     cached_rows = 0
 
-    if os.path.exists(cache_file):
+    if history_cache_exists(cache_file):
         try:
-            cached_df = pd.read_parquet(cache_file)
-            if not cached_df.empty:
-                last_cached_date = cached_df['日期'].max().date()
-                cached_rows = len(cached_df)
+            # 拉取计划只需要行数与最新日期，直接读 footer 统计信息
+            cached_rows, _, max_date = history_cache_summary(cache_file)
+            if cached_rows and max_date is not None:
+                last_cached_date = pd.Timestamp(max_date).date()
         except Exception:
-            pass
+            cached_rows = 0
 
     today = datetime.now().date()
     if last_cached_date:
@@ -71,17 +408,8 @@ def build_fetch_plan(pool_name, max_workers, request_delay, fetch_spot):
         start_date_str = get_start_date(months_back=3)
     end_date_str = today.strftime("%Y%m%d")
 
-    total_stocks = None
     try:
-        cons_df = with_retry(lambda: ak.index_stock_cons(symbol=index_code), retries=3, delay=1.0)
-        if cons_df is not None and not cons_df.empty:
-            if 'variety' in cons_df.columns:
-                code_col = 'variety'
-            elif '品种代码' in cons_df.columns:
-                code_col = '品种代码'
-            else:
-                code_col = cons_df.columns[0]
-            total_stocks = len(cons_df[code_col].tolist())
+        total_stocks = _index_constituent_count(index_code)
     except Exception:
         total_stocks = None
 
@@ -94,8 +422,8 @@ def build_fetch_plan(pool_name, max_workers, request_delay, fetch_spot):
     return {
         "pool_name": pool_name,
         "index_code": index_code,
-        "cache_file": cache_file,
-        "has_cache": not cached_df.empty,
+        "cache_dir": _history_dataset_dir(cache_file),
+        "has_cache": cached_rows > 0,
         "cached_rows": cached_rows,
         "last_cached_date": last_cached_date,
         "start_date_str": start_date_str,
@@ -108,6 +436,34 @@ def build_fetch_plan(pool_name, max_workers, request_delay, fetch_spot):
         "est_seconds": est_seconds
     }
 
+# 板块分类：SH=沪市主板, SZ=深市主板, CYB=创业板(30开头), KCB=科创板(688开头)
+BOARD_CATEGORIES = ['SH', 'SZ', 'CYB', 'KCB']
+SH_BOARDS = ['SH', 'KCB']
+
+
+def add_board_column(df):
+    """
+    追加 board 分类列。只对去重后的代码做字符串判断，再按分类编码回填到每一行，
+    下游过滤直接比较分类值，不必每次 astype(str).str.startswith。
+    """
+    if df.empty or '代码' not in df.columns:
+        return df
+    board = df.get('board')
+    if board is not None and isinstance(board.dtype, pd.CategoricalDtype) and not board.isna().any():
+        # 已带完整的 board 列 (如直接来自缓存读取结果)，无需重复推导
+        return df
+    codes = df['代码'].astype('category')
+    cats = codes.cat.categories.astype(str)
+    board_of_cat = np.select(
+        [cats.str.startswith('688'), cats.str.startswith('6'), cats.str.startswith('30')],
+        ['KCB', 'SH', 'CYB'],
+        default='SZ'
+    )
+    board_codes = pd.Categorical(board_of_cat, categories=BOARD_CATEGORIES).codes
+    df['board'] = pd.Categorical.from_codes(board_codes[codes.cat.codes.to_numpy()], categories=BOARD_CATEGORIES)
+    return df
+
+
 def fetch_history_data(
     pool_name="沪深300 (大盘)",
     allow_download=True,
@@ -118,7 +474,42 @@ def fetch_history_data(
     """
     获取指定成分股近 3 个月的日线数据（可配置）。
     逻辑复刻自 app1.py (稳定版)，支持多指数池。
+    返回的数据附带 board 板块分类列。
+    """
+    df = _load_history_data(pool_name, allow_download, max_workers, request_delay, fetch_spot)
+    return add_board_column(_downcast_history_frame(df))
+
+
+@st.cache_data(show_spinner=False, max_entries=6)
+def _load_history_cache_frame(cache_file, summary):
+    """
+    读取日线缓存并完成数值收窄与 board 列推导。summary 为 history_cache_summary() 的
+    (行数, 最早日期, 最新日期)，只读 footer 即可得到；缓存内容变化时 summary 随之变化，
+    其余 rerun 直接复用上次整理好的结果，不再重新扫描整个数据集。
     """
+    return add_board_column(_downcast_history_frame(read_history_cache(cache_file)))
+
+
+def _downcast_history_frame(df):
+    """
+    旧缓存里的数值列可能仍是 float64：统一收窄到 _HISTORY_NUMERIC_TYPES，
+    代码/名称 转为分类类型 (从缓存读出时已是分类)，groupby / 比较都走整数编码。
+    """
+    if df.empty:
+        return df
+    pending = {
+        col: arrow_type for col, arrow_type in _HISTORY_NUMERIC_TYPES.items()
+        if col in df.columns and df[col].dtype != arrow_type.to_pandas_dtype()
+    }
+    if pending:
+        df = _cast_numeric_columns(df, pending)
+    for col in ('代码', '名称'):
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    return df
+
+
+def _load_history_data(pool_name, allow_download, max_workers, request_delay, fetch_spot):
     _disable_proxy_env()
 
     config = STOCK_POOLS.get(pool_name, STOCK_POOLS["沪深300 (大盘)"])
@@ -130,9 +521,9 @@ def fetch_history_data(
 
     # 1. 尝试加载本地缓存
     cache_min_codes = 50
-    if os.path.exists(cache_file):
+    if history_cache_exists(cache_file):
         try:
-            cached_df = pd.read_parquet(cache_file)
+            cached_df = _load_history_cache_frame(cache_file, history_cache_summary(cache_file))
             if not cached_df.empty:
                 last_cached_date = cached_df['日期'].max().date()
                 st.toast(f"✅ 已加载本地缓存 [{pool_name}]，最新日期: {last_cached_date}")
@@ -143,14 +534,14 @@ def fetch_history_data(
 
     if not cached_df.empty:
         try:
-            unique_codes = cached_df['代码'].astype(str).nunique()
+            unique_codes = cached_df['代码'].nunique()
         except Exception:
             unique_codes = 0
         if unique_codes < cache_min_codes:
             st.warning(f"检测到缓存样本过少({unique_codes}只)，将忽略该缓存并重新拉取。")
             log_info(f"缓存可能不完整: {pool_name} | 唯一码 {unique_codes}")
             try:
-                os.remove(cache_file)
+                remove_history_cache(cache_file)
                 log_info(f"已删除不完整缓存: {cache_file}")
             except Exception:
                 pass
@@ -270,40 +661,35 @@ def fetch_history_data(
             with fail_lock:
                 proxy_error_seen = True
 
+        # 今日日线缺失时由 spot 补全；补全在拉取结束后统一向量化完成
+        fill_today_from_spot = bool(today_spot_map) and end_date_str == datetime.now().strftime("%Y%m%d")
+        fetched_codes = []
+
         # 循环获取历史
         def fetch_one_stock(code, name):
             try:
                 if request_delay > 0:
                     time.sleep(request_delay)
-                # 获取日线
-                df_hist = ak.stock_zh_a_hist(symbol=code, start_date=start_date_str, end_date=end_date_str, adjust="qfq")
-                
-                # 检查是否包含今天
-                fetched_today = False
-                if df_hist is not None and not df_hist.empty:
-                    df_hist['日期'] = pd.to_datetime(df_hist['日期'])
-                    if end_date_str in df_hist['日期'].dt.strftime("%Y%m%d").values:
-                        fetched_today = True
-                else:
-                    df_hist = pd.DataFrame()
-
-                # 补全今天
-                if (not fetched_today) and (end_date_str == datetime.now().strftime("%Y%m%d")):
-                    if code in today_spot_map:
-                        row = today_spot_map[code]
-                        try:
-                             new_row = pd.DataFrame([{
-                                 '日期': pd.to_datetime(end_date_str),
-                                 '收盘': row['最新价'],
-                                 '涨跌幅': row['涨跌幅'],
-                                 '成交额': row['成交额'],
-                                 '代码': code,
-                                 '名称': name
-                             }])
-                             df_hist = pd.concat([df_hist, new_row], ignore_index=True)
-                        except Exception:
-                            pass
-                
+                # 获取日线：只有网络/限频错误才收缩共享并发并按 Retry-After 或带抖动的指数退避重试；
+                # 其他错误 (解析失败、代码无数据等) 直接失败，不拖慢其他线程
+                limiter = _HOST_LIMITERS["eastmoney"]
+                for attempt in range(_HISTORY_FETCH_ATTEMPTS):
+                    limiter.wait_if_throttled()
+                    try:
+                        df_hist = ak.stock_zh_a_hist(symbol=code, start_date=start_date_str, end_date=end_date_str, adjust="qfq")
+                    except Exception as e:
+                        if not is_transient_error(e):
+                            limiter.release(None)
+                            raise
+                        retry_after = retry_after_seconds(e)
+                        limiter.release(False, retry_after)
+                        if attempt == _HISTORY_FETCH_ATTEMPTS - 1 or _stop_requested():
+                            raise
+                        time.sleep(retry_after if retry_after is not None else backoff_delay(attempt))
+                        continue
+                    limiter.release(True)
+                    break
+
                 if df_hist is not None and not df_hist.empty:
                     # 确保列存在
                     cols_needed = ['日期', '收盘', '涨跌幅', '成交额']
@@ -313,10 +699,15 @@ def fetch_history_data(
                             return None
                     
                     df_hist = df_hist[cols_needed].copy()
+                    df_hist['日期'] = pd.to_datetime(df_hist['日期'])
                     df_hist['代码'] = code
                     df_hist['名称'] = name
                     return df_hist
 
+                if fill_today_from_spot and code in today_spot_map:
+                    # 日线为空但有今日 spot，视为成功，稍后统一补全
+                    return pd.DataFrame()
+
                 _record_sample(empty_samples, code)
             except Exception as e:
                 msg = str(e)
@@ -326,10 +717,6 @@ def fetch_history_data(
             return None
         # Use concurrency as in app1.py
         ctx = get_script_run_ctx()
-        def fetch_one_stock_wrapper(code, name):
-            if ctx:
-                add_script_run_ctx(threading.current_thread(), ctx)
-            return fetch_one_stock(code, name)
         if max_workers <= 1:
             for i, code in enumerate(stock_list):
                 if _stop_requested():
@@ -339,7 +726,9 @@ def fetch_history_data(
                 name = stock_names.get(code, code)
                 res = fetch_one_stock(code, name)
                 if res is not None:
-                    new_data_list.append(res)
+                    if not res.empty:
+                        new_data_list.append(res)
+                    fetched_codes.append(code)
                     success_count += 1
                 else:
                     fail_count += 1
@@ -347,8 +736,10 @@ def fetch_history_data(
                     progress_bar.progress((i + 1) / total_stocks)
                     status_text.text(f"正在获取日线 [{pool_name}]: {i+1}/{total_stocks}")
         else:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-                 future_map = {executor.submit(fetch_one_stock_wrapper, c, stock_names.get(c, c)): c for c in stock_list}
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_workers, initializer=_bind_script_run_ctx, initargs=(ctx,)
+            ) as executor:
+                 future_map = {executor.submit(fetch_one_stock, c, stock_names.get(c, c)): c for c in stock_list}
                  
                  for i, future in enumerate(concurrent.futures.as_completed(future_map)):
                      if _stop_requested():
@@ -363,12 +754,21 @@ def fetch_history_data(
                      
                      res = future.result()
                      if res is not None:
-                         new_data_list.append(res)
+                         if not res.empty:
+                             new_data_list.append(res)
+                         fetched_codes.append(future_map[future])
                          success_count += 1
                      else:
                          fail_count += 1
         status_text.empty()
         progress_bar.empty()
+
+        new_df = pd.concat(new_data_list, ignore_index=True) if new_data_list else pd.DataFrame()
+        if fill_today_from_spot and fetched_codes:
+            spot_today_df = _build_spot_today_rows(new_df, fetched_codes, today_spot_map, stock_names, end_date_str)
+            if not spot_today_df.empty:
+                new_df = pd.concat([new_df, spot_today_df], ignore_index=True) if not new_df.empty else spot_today_df
+
         log_info(f"完成日线获取: {pool_name} | 成功 {success_count} | 失败 {fail_count}")
         if proxy_error_seen:
             log_info("检测到代理错误: 已默认禁用代理。如需启用，请设置 CAPMAP_USE_PROXY=1")
@@ -385,18 +785,15 @@ def fetch_history_data(
                 if cached_df.empty:
                     return pd.DataFrame()
                 return cached_df
-        if not new_data_list and cached_df.empty:
+        if new_df.empty and cached_df.empty:
             st.error("日线拉取全部失败，可能是网络/代理/限频导致。请降低并发、增大间隔后重试。")
             return pd.DataFrame()
 
         # 合并逻辑
-        if new_data_list:
-            new_df = pd.concat(new_data_list, ignore_index=True)
+        if not new_df.empty:
             # 类型转换
             new_df['日期'] = pd.to_datetime(new_df['日期'])
-            new_df['涨跌幅'] = pd.to_numeric(new_df['涨跌幅'], errors='coerce')
-            new_df['成交额'] = pd.to_numeric(new_df['成交额'], errors='coerce')
-            new_df['收盘'] = pd.to_numeric(new_df['收盘'], errors='coerce')
+            new_df = _cast_numeric_columns(new_df, _HISTORY_NUMERIC_TYPES)
             
             if cached_df.empty:
                 final_df = new_df
@@ -418,12 +815,12 @@ def fetch_history_data(
             final_df['名称'] = final_df['代码'].map(stock_names).fillna(final_df['名称'])
         
         # 保存缓存
-        if new_data_list or cached_df.empty:
+        if not new_df.empty or cached_df.empty:
             try:
-                cache_dir = os.path.dirname(cache_file)
-                if cache_dir and not os.path.exists(cache_dir):
-                    os.makedirs(cache_dir, exist_ok=True)
-                final_df.to_parquet(cache_file)
+                if cached_df.empty:
+                    write_history_cache(cache_file, final_df)
+                else:
+                    append_history_cache(cache_file, final_df[final_df['日期'] > pd.Timestamp(last_cached_date)])
                 if not cached_df.empty:
                     st.toast(f"💾 [{pool_name}] 增量数据已合并并保存")
                 else:
@@ -440,47 +837,180 @@ def fetch_history_data(
         return pd.DataFrame()
 
 MIN_CACHE_DIR = str(DATA_DIR / "min_cache")
+# 按数据源主机的自适应限流：上限与侧边栏最大线程数一致，限频时自动收缩。
+# 日线与分时接口都在东方财富，共用同一个限流器，一方被限频时另一方同样退让
+_HOST_LIMITERS = {"eastmoney": RateLimiter(max_concurrency=20)}
+_INTRADAY_LIMITER = _HOST_LIMITERS["eastmoney"]
+# 单只股票日线请求的最大尝试次数
+_HISTORY_FETCH_ATTEMPTS = 3
+_LEGACY_MIN_CACHE_SUFFIX = ".parquet"
+_MIN_CACHE_SUFFIX = ".feather"
+_MIN_CACHE_MIGRATION_LOCK = threading.Lock()
+_MIN_CACHE_MIGRATION_STARTED = False
 
 
 def _min_cache_path(symbol, date_str, period, is_index):
     safe_symbol = str(symbol).replace("/", "_")
     safe_date = str(date_str).replace(":", "").replace(" ", "_")
     suffix = "idx" if is_index else "stk"
-    filename = f"{safe_symbol}_{safe_date}_{period}_{suffix}.parquet"
+    filename = f"{safe_symbol}_{safe_date}_{period}_{suffix}{_MIN_CACHE_SUFFIX}"
     return os.path.join(MIN_CACHE_DIR, filename)
 
 
-@st.cache_data(ttl=3600*24, show_spinner=False)
-def fetch_cached_min_data(symbol, date_str, is_index=False, period='1'):
+# 进程内 LRU：(path, mtime_ns) -> Arrow Table。mtime 变化即视为新版本，旧条目自然淘汰
+_MIN_TABLE_CACHE = OrderedDict()
+_MIN_TABLE_CACHE_LOCK = threading.Lock()
+_MIN_TABLE_CACHE_SIZE = 4096
+
+
+def _min_table_cache_get(key):
+    with _MIN_TABLE_CACHE_LOCK:
+        table = _MIN_TABLE_CACHE.get(key)
+        if table is not None:
+            _MIN_TABLE_CACHE.move_to_end(key)
+        return table
+
+
+def _min_table_cache_put(key, table):
+    with _MIN_TABLE_CACHE_LOCK:
+        _MIN_TABLE_CACHE[key] = table
+        _MIN_TABLE_CACHE.move_to_end(key)
+        while len(_MIN_TABLE_CACHE) > _MIN_TABLE_CACHE_SIZE:
+            _MIN_TABLE_CACHE.popitem(last=False)
+
+
+def clear_min_memory_cache():
+    """清空进程内的分时 Arrow 表 LRU (磁盘上的缓存文件不受影响)。"""
+    with _MIN_TABLE_CACHE_LOCK:
+        _MIN_TABLE_CACHE.clear()
+
+
+def _read_min_cache(path):
+    # Feather 保留列类型，读取时无需再解析 time 列；命中进程内缓存时只做一次内存拷贝
+    key = (path, os.stat(path).st_mtime_ns)
+    table = _min_table_cache_get(key)
+    if table is None:
+        table = feather.read_table(path, memory_map=False)
+        _min_table_cache_put(key, table)
+    return table.to_pandas()
+
+
+def _read_min_cache_batch(paths):
     """
-    原子化获取单个标的的分时数据，独立缓存。
-    避免因股票列表组合变化导致整个缓存失效。
-    params:
-    period: '1', '5', '15', '30', '60'
+    用一次 dataset 扫描读取多个分时缓存 (C++ 线程并行解码)，
+    按来源文件拆回 {path: DataFrame}，键与传入的 path 完全一致。已在进程内缓存的文件直接复用，
+    读取失败时返回已得到的部分，由调用方逐个回退。
     """
-    _disable_proxy_env()
-    cache_path = _min_cache_path(symbol, date_str, period, is_index)
-    if os.path.exists(cache_path):
+    result = {}
+    missing = {}
+    for path in paths:
         try:
-            cached_df = pd.read_parquet(cache_path)
-            if cached_df is not None and not cached_df.empty:
-                if 'time' in cached_df.columns:
-                    cached_df['time'] = pd.to_datetime(cached_df['time'])
-                return cached_df
-        except Exception:
-            pass
+            key = (path, os.stat(path).st_mtime_ns)
+        except OSError:
+            continue
+        table = _min_table_cache_get(key)
+        if table is not None:
+            result[path] = table.to_pandas()
+        else:
+            missing[path] = key
+    if not missing:
+        return result
+    try:
+        missing_paths = list(missing)
+        dataset = ds.dataset(missing_paths, format="feather")
+        # fragment.path 是 pyarrow 规范化后的路径 (Windows 上分隔符变为 /)，按输入顺序映射回调用方的路径
+        source = {fragment.path: path for fragment, path in zip(dataset.get_fragments(), missing_paths)}
+        batches = {}
+        for tagged in dataset.scanner(use_threads=True).scan_batches():
+            batches.setdefault(source[tagged.fragment.path], []).append(tagged.record_batch)
+    except Exception:
+        return result
+    for path, parts in batches.items():
+        table = pa.Table.from_batches(parts)
+        _min_table_cache_put(missing[path], table)
+        result[path] = table.to_pandas()
+    return result
 
-    start_time = f"{date_str} 09:30:00"
-    end_time = f"{date_str} 15:00:00"
-    
-    # 指数退避策略全局变量 (简单模拟)
-    if not hasattr(fetch_cached_min_data, "current_backoff"):
-        fetch_cached_min_data.current_backoff = 0
-            
+
+def _write_min_cache(path, df):
+    """LZ4 压缩的 Feather 写入，先写临时文件再原子替换，避免读到半截文件。"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    feather.write_feather(pa.Table.from_pandas(df, preserve_index=False), tmp_path, compression="lz4")
+    os.replace(tmp_path, path)
+
+
+def _migrate_legacy_min_cache(legacy_path):
+    """把旧版 .parquet 分时缓存转成 .feather。原文件保留，之后只读 feather。"""
+    target_path = legacy_path[:-len(_LEGACY_MIN_CACHE_SUFFIX)] + _MIN_CACHE_SUFFIX
+    df = pd.read_parquet(legacy_path)
+    if 'time' in df.columns:
+        df['time'] = pd.to_datetime(df['time'])
+    _write_min_cache(target_path, df)
+    return df
+
+
+def _migrate_min_cache_dir():
+    converted = 0
+    failed = 0
+    try:
+        names = os.listdir(MIN_CACHE_DIR)
+    except OSError:
+        return
+    existing = set(names)
+    for name in names:
+        if not name.endswith(_LEGACY_MIN_CACHE_SUFFIX):
+            continue
+        if name[:-len(_LEGACY_MIN_CACHE_SUFFIX)] + _MIN_CACHE_SUFFIX in existing:
+            continue # 已迁移过，重复启动时跳过
+        try:
+            _migrate_legacy_min_cache(os.path.join(MIN_CACHE_DIR, name))
+            converted += 1
+        except Exception as e:
+            failed += 1
+            log_info(f"分时缓存迁移失败: {name} | {e}")
+    if converted or failed:
+        log_info(f"分时缓存迁移完成: 转换 {converted} | 失败 {failed}")
+
+
+def start_min_cache_migration():
+    """
+    启动一次性的后台迁移线程 (parquet -> feather)。
+    进程内只会启动一次，Streamlit 重跑脚本时重复调用无副作用。
+    """
+    global _MIN_CACHE_MIGRATION_STARTED
+    with _MIN_CACHE_MIGRATION_LOCK:
+        if _MIN_CACHE_MIGRATION_STARTED:
+            return False
+        _MIN_CACHE_MIGRATION_STARTED = True
+    t = threading.Thread(target=_migrate_min_cache_dir, name="MinCacheMigration", daemon=True)
+    t.start()
+    return True
+
+
+def _load_legacy_min_cache(cache_path):
+    """后台迁移尚未处理到该文件时，就地把旧版 .parquet 缓存转换后返回；没有则返回 None。"""
+    legacy_path = cache_path[:-len(_MIN_CACHE_SUFFIX)] + _LEGACY_MIN_CACHE_SUFFIX
+    if not os.path.exists(legacy_path):
+        return None
+    try:
+        return _migrate_legacy_min_cache(legacy_path)
+    except Exception:
+        return None
+
+
+def _request_min_data(symbol, start_time, end_time, is_index, period):
+    """
+    请求 [start_time, end_time] 的原始分时数据，带重试；列名统一为 time/open/close，time 已解析。
+    请求失败返回 None，接口无数据返回空 DataFrame。
+    """
+    _disable_proxy_env()
     # 简单的重试机制
     max_retries = 3
     
     for attempt in range(max_retries):
+        # 所有分时请求共享同一个 AIMD 限流器 (前台线程池与后台预取)
+        _INTRADAY_LIMITER.wait_if_throttled()
         try:
             if is_index:
                 # 指数接口
@@ -488,109 +1018,278 @@ def fetch_cached_min_data(symbol, date_str, is_index=False, period='1'):
             else:
                 # 个股接口
                 df = ak.stock_zh_a_hist_min_em(symbol=symbol, start_date=start_time, end_date=end_time, period=period, adjust='qfq')
-            
-            if df is not None and not df.empty:
-                # 成功 - 重置退避
-                if fetch_cached_min_data.current_backoff > 0:
-                     print(f"[{datetime.now().time()}] API 恢复。重置退避时间。")
-                     fetch_cached_min_data.current_backoff = 0
-
-                # 统一列名
-                if '时间' in df.columns:
-                    df.rename(columns={'时间': 'time', '开盘': 'open', '收盘': 'close'}, inplace=True)
-                
-                # 简单清洗
-                df['time'] = pd.to_datetime(df['time'])
-                
-                # 计算涨跌幅(相对于当日开盘)
-                base_price = df['open'].iloc[0]
-                df['pct_chg'] = (df['close'] - base_price) / base_price * 100
-                
-                result_df = df[['time', 'pct_chg', 'close']]
-                try:
-                    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
-                    result_df.to_parquet(cache_path)
-                except Exception:
-                    pass
-                return result_df
-                
+        except Exception as e:
+            if not is_transient_error(e):
+                # 停牌/代码无效时 akshare 解析空响应会抛 TypeError/KeyError 等：重试无意义，也不收缩共享并发
+                _INTRADAY_LIMITER.release(None)
+                return None
+            # 网络/限频错误：收缩并发，按 Retry-After 或带抖动的指数退避等待后重试
+            retry_after = retry_after_seconds(e)
+            _INTRADAY_LIMITER.release(False, retry_after)
+            if attempt == max_retries - 1 or _stop_requested():
+                return None
+            time.sleep(retry_after if retry_after is not None else backoff_delay(attempt))
+            continue
+        _INTRADAY_LIMITER.release(True)
+
+        try:
+            if df is None or df.empty:
+                return pd.DataFrame()
+            # 统一列名
+            if '时间' in df.columns:
+                df.rename(columns={'时间': 'time', '开盘': 'open', '收盘': 'close'}, inplace=True)
+            # 简单清洗：接口时间格式固定，显式 format 走快速解析路径
+            df['time'] = pd.to_datetime(df['time'], format='%Y-%m-%d %H:%M:%S', errors='coerce', cache=True)
+            return df
         except Exception:
-            # 失败处理逻辑
-            if fetch_cached_min_data.current_backoff == 0:
-                fetch_cached_min_data.current_backoff = 60 # 初始 1 分钟
-            else:
-                fetch_cached_min_data.current_backoff *= 2 # 翻倍
-            pass
+            # 返回内容无法解析，再请求一次也是同样结果
+            return None
 
     return None
 
+
+def _min_frame_for_day(day_df):
+    """单日原始分时 -> (time, pct_chg, close)，涨跌幅相对当日开盘，价格精度用 float32 足够。"""
+    close = day_df['close'].to_numpy(dtype=np.float32)
+    base_price = np.float32(day_df['open'].to_numpy()[0])
+    return pd.DataFrame({
+        'time': day_df['time'].to_numpy(),
+        'pct_chg': (close - base_price) / base_price * np.float32(100.0),
+        'close': close
+    }).dropna(subset=['time'])
+
+
+def _fetch_min_data_remote(symbol, date_str, is_index, period, cache_path):
+    """只走网络拉取分时数据并写入 cache_path，不再检查本地缓存。失败返回 None。"""
+    df = _request_min_data(symbol, f"{date_str} 09:30:00", f"{date_str} 15:00:00", is_index, period)
+    if df is None or df.empty:
+        return None
+    try:
+        result_df = _min_frame_for_day(df)
+    except Exception:
+        return None
+    try:
+        _write_min_cache(cache_path, result_df)
+    except Exception:
+        pass
+    return result_df
+
+
+def _min_cache_available(symbol, date_str, period, is_index):
+    cache_path = _min_cache_path(symbol, date_str, period, is_index)
+    legacy_path = cache_path[:-len(_MIN_CACHE_SUFFIX)] + _LEGACY_MIN_CACHE_SUFFIX
+    return os.path.exists(cache_path) or os.path.exists(legacy_path)
+
+
+def fetch_min_data_range(symbol, date_strs, is_index=False, period='1'):
+    """
+    一次请求覆盖 date_strs 中最早到最晚的整段区间，按交易日拆开后逐日写入单日缓存。
+    已有缓存的日期不再请求。返回已有缓存或本次写入的日期集合；请求失败返回 None。
+    """
+    wanted = [d for d in date_strs if not _min_cache_available(symbol, d, period, is_index)]
+    done = set(date_strs) - set(wanted)
+    if not wanted:
+        return done
+    wanted.sort()
+    df = _request_min_data(symbol, f"{wanted[0]} 09:30:00", f"{wanted[-1]} 15:00:00", is_index, period)
+    if df is None:
+        return None
+    df = df.dropna(subset=['time'])
+    if df.empty:
+        return done
+    # 接口按时间升序返回：按日期变化点切段，每段即一个交易日
+    days = df['time'].to_numpy().astype('datetime64[D]')
+    bounds = np.r_[np.flatnonzero(np.r_[True, days[1:] != days[:-1]]), len(days)]
+    wanted_set = set(wanted)
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        d_str = str(days[lo])
+        if d_str not in wanted_set:
+            continue
+        try:
+            _write_min_cache(_min_cache_path(symbol, d_str, period, is_index), _min_frame_for_day(df.iloc[lo:hi]))
+            done.add(d_str)
+        except Exception:
+            pass
+    return done
+
+
 # --- 后台预取线程逻辑 ---
-@st.cache_data(ttl=3600*24, show_spinner=False)
-def fetch_cached_min_data_wrapper(symbol, date_str, is_index=False, period='1'):
-    """Wrapper to be called by background thread"""
-    # This is just a direct call to the cached function
-    # In background thread, we can call this.
-    return fetch_cached_min_data(symbol, date_str, is_index, period)
+# 后台预取：并发线程数 (实际并发还受 _INTRADAY_LIMITER 的 AIMD 上限约束) 与单任务最大尝试次数
+_PREFETCH_WORKERS = 4
+_PREFETCH_MAX_ATTEMPTS = 8
+# 同一标的的多个日期合并为一次区间请求，每批最多覆盖的交易日数
+_PREFETCH_BATCH_DAYS = 20
+_PREFETCH_STOP = threading.Event()
+
 
 def background_prefetch_task(date_list, origin_df):
     """
     后台线程：执行数据预取。
+    同一标的的日期按 _PREFETCH_BATCH_DAYS 分批，每批一次区间请求，拆成单日缓存写入。
+    任务按 (可执行时间, 序号) 放入优先队列，多个线程取最早就绪的任务；
+    失败的任务带退避时间放回队列，不阻塞其他标的。
     """
     total_dates = len(date_list)
     print(f"\n[后台任务] 开始预取 {total_dates} 天的数据。")
     
-    current_backoff = 0 # 秒
-    
     indices_codes = ["000300", "000001", "399001"]
     
-    for i, d in enumerate(date_list):
+    dates_by_target = {}
+    for d in date_list:
         d_str = d.strftime("%Y-%m-%d")
-        print(f"[后台任务] 正在处理: {d_str} ({i+1}/{total_dates})")
         
         # 筛选
-        daily = origin_df[origin_df['日期'].dt.date == d]
+        daily = slice_trading_day(origin_df, d)
         if daily.empty: continue
         
         # Top 25
         top_stocks = daily.sort_values('成交额', ascending=False).head(25)['代码'].tolist()
         
-        # 任务列表
-        tasks = []
-        for code in indices_codes: tasks.append((code, d_str, True))
-        for code in top_stocks: tasks.append((code, d_str, False))
-        
-        # 内层逐个执行 (为了方便控制退避，且后台任务不急于一时的并发，稳定第一)
-        for t_code, t_date, t_is_index in tasks:
-            
-            # Indefinite retry loop with backoff
-            while True:
-                try:
-                    # 检查退避
-                    if current_backoff > 0:
-                        print(f"[后台任务] 处于冷却状态。等待 {current_backoff} 秒...")
-                        time.sleep(current_backoff)
-                        
-                    fetch_cached_min_data(t_code, t_date, is_index=t_is_index, period='1')
-                    
-                    # Success
-                    if current_backoff > 0:
-                        print(f"[后台任务] 已恢复。重置退避时间。")
-                        current_backoff = 0
-                    
-                    time.sleep(0.1)
-                    break # 跳出 while，处理下一个 task
-
-                except Exception as e:
-                    print(f"[后台任务] 获取 {t_code} ({t_date}) 失败: {e}")
-                    # 触发退避机制
-                    if current_backoff == 0:
-                        current_backoff = 60
-                    else:
-                        current_backoff *= 2
-                    
-                    print(f"[后台任务] 退避时间增加到 {current_backoff}秒。正在重试同一任务...")
-    
-    print("[后台任务] 所有任务已完成。")
+        for target in [(c, True) for c in indices_codes] + [(c, False) for c in top_stocks]:
+            dates_by_target.setdefault(target, []).append(d_str)
+
+    tasks = queue.PriorityQueue()
+    order = 0
+    now = time.monotonic()
+    for (code, is_index), d_strs in dates_by_target.items():
+        d_strs.sort()
+        for i in range(0, len(d_strs), _PREFETCH_BATCH_DAYS):
+            tasks.put((now, order, code, tuple(d_strs[i:i + _PREFETCH_BATCH_DAYS]), is_index, 0))
+            order += 1
+
+    state = {'remaining': tasks.qsize(), 'done': 0, 'failed': 0}
+    total_tasks = state['remaining']
+    state_lock = threading.Lock()
+
+    def _finish(ok):
+        with state_lock:
+            state['remaining'] -= 1
+            state['done' if ok else 'failed'] += 1
+            finished = state['done'] + state['failed']
+        if finished % 25 == 0 or finished == total_tasks:
+            print(f"[后台任务] 进度 {finished}/{total_tasks} (失败 {state['failed']})")
+
+    def _run():
+        while not _PREFETCH_STOP.is_set():
+            with state_lock:
+                if state['remaining'] <= 0:
+                    return
+            try:
+                ready_at, seq, code, d_strs, is_index, attempt = tasks.get(timeout=0.5)
+            except queue.Empty:
+                continue # 其他线程持有的任务可能失败后重新入队
+            delay = ready_at - time.monotonic()
+            if delay > 0:
+                # 最早的任务也未到时间：放回并等待 (可被停止信号打断)
+                tasks.put((ready_at, seq, code, d_strs, is_index, attempt))
+                _PREFETCH_STOP.wait(min(delay, 1.0))
+                continue
+
+            span = f"{d_strs[0]}~{d_strs[-1]}"
+            retry_after = None
+            try:
+                # 服务端正常应答即算完成：区间内没有返回的日期 (停牌/超出可查范围) 不再重试
+                ok = fetch_min_data_range(code, d_strs, is_index=is_index, period='1') is not None
+            except Exception as e:
+                print(f"[后台任务] 获取 {code} ({span}) 失败: {e}")
+                retry_after = retry_after_seconds(e)
+                ok = False
+
+            if ok:
+                _finish(True)
+            elif attempt + 1 >= _PREFETCH_MAX_ATTEMPTS:
+                print(f"[后台任务] {code} ({span}) 连续失败 {attempt + 1} 次，放弃。")
+                _finish(False)
+            else:
+                # 退避：首次约 60 秒，之后翻倍，带随机抖动；只推迟该任务本身
+                backoff = retry_after if retry_after is not None else backoff_delay(attempt, base=60.0, cap=1800.0)
+                tasks.put((time.monotonic() + backoff, seq, code, d_strs, is_index, attempt + 1))
+
+    ctx = get_script_run_ctx()
+    workers = []
+    for i in range(min(_PREFETCH_WORKERS, max(1, total_tasks))):
+        t = threading.Thread(target=_run, name=f"PrefetchWorker-{i}", daemon=True)
+        if ctx:
+            add_script_run_ctx(t, ctx)
+        t.start()
+        workers.append(t)
+    for t in workers:
+        t.join()
+
+    if _PREFETCH_STOP.is_set():
+        print(f"[后台任务] 已停止，完成 {state['done']}/{total_tasks}。")
+    else:
+        print("[后台任务] 所有任务已完成。")
+
+
+_PREFETCH_QUEUE = queue.Queue()
+_PREFETCH_LOCK = threading.Lock()
+_PREFETCH_INFLIGHT = set()
+_PREFETCH_WORKER = None
+
+
+def _prefetch_worker_loop():
+    """常驻的预取线程：串行消费队列中的任务。"""
+    while True:
+        key, job = _PREFETCH_QUEUE.get()
+        _PREFETCH_STOP.clear()
+        try:
+            job()
+        except Exception as e:
+            log_info(f"[后台任务] 预取任务异常: {e}")
+        finally:
+            with _PREFETCH_LOCK:
+                _PREFETCH_INFLIGHT.discard(key)
+            _PREFETCH_QUEUE.task_done()
+
+
+def _ensure_prefetch_worker():
+    global _PREFETCH_WORKER
+    with _PREFETCH_LOCK:
+        if _PREFETCH_WORKER is not None and _PREFETCH_WORKER.is_alive():
+            return
+        t = threading.Thread(target=_prefetch_worker_loop, name="PrefetchWorker", daemon=True)
+        add_script_run_ctx(t)
+        t.start()
+        _PREFETCH_WORKER = t
+
+
+def submit_prefetch_job(date_list, origin_df):
+    """
+    把一次预取加入共享队列，由唯一的常驻线程执行。
+    相同 (日期, 标的) 的任务在排队或执行期间不会重复入队。
+    """
+    codes = tuple(sorted(origin_df['代码'].astype(str).unique()))
+    key = (tuple(d.strftime("%Y-%m-%d") for d in date_list), codes)
+    with _PREFETCH_LOCK:
+        if key in _PREFETCH_INFLIGHT:
+            return False
+        _PREFETCH_INFLIGHT.add(key)
+    _ensure_prefetch_worker()
+    _PREFETCH_QUEUE.put((key, lambda: background_prefetch_task(date_list, origin_df)))
+    return True
+
+
+def stop_prefetch():
+    """停止正在执行的预取并丢弃排队中的任务，已写入的分时缓存保留。"""
+    _PREFETCH_STOP.set()
+    while True:
+        try:
+            key, _ = _PREFETCH_QUEUE.get_nowait()
+        except queue.Empty:
+            break
+        with _PREFETCH_LOCK:
+            _PREFETCH_INFLIGHT.discard(key)
+        _PREFETCH_QUEUE.task_done()
+
+
+def prefetch_in_progress():
+    with _PREFETCH_LOCK:
+        return bool(_PREFETCH_INFLIGHT)
+
+
+# 分时抓取任务：字段访问走 tuple 槽位，比 dict 更轻
+_IntradayTask = namedtuple('_IntradayTask', 'code name to_val is_index')
 
 
 def fetch_intraday_data_v2(stock_codes, target_date_str, period='1', max_workers=1, request_delay=0.0):
@@ -606,56 +1305,66 @@ def fetch_intraday_data_v2(stock_codes, target_date_str, period='1', max_workers
         '399001': '深证成指'
     }
 
-    tasks = []
-
-    for idx_code, idx_name in indices_map.items():
-        tasks.append({
-            'type': 'index',
-            'code': idx_code,
-            'name': idx_name,
-            'to_val': 99999999999
-        })
+    tasks = [_IntradayTask(idx_code, idx_name, 99999999999, True) for idx_code, idx_name in indices_map.items()]
+    tasks.extend(_IntradayTask(code, name, to_val, False) for code, name, to_val in stock_codes)
 
-    for code, name, to_val in stock_codes:
-        tasks.append({
-            'type': 'stock',
-            'code': code,
-            'name': name,
-            'to_val': to_val
-        })
+    def _make_result(task, data):
+        return {
+            'code': task.code
+            , 'name': task.name
+            , 'data': data
+            , 'turnover': task.to_val
+            , 'is_index': task.is_index
+        }
 
-    def _worker(task):
+    def _worker(task, cache_path):
         try:
-            is_index = (task['type'] == 'index')
-            if request_delay > 0:
-                time.sleep(request_delay)
-            data = fetch_cached_min_data(task['code'], target_date_str, is_index=is_index, period=period)
+            # 批量扫描可能漏读 (扫描失败或单个分片损坏)：先逐个读 .feather，再试旧版缓存，最后才走网络
+            data = None
+            if os.path.exists(cache_path):
+                try:
+                    data = _read_min_cache(cache_path)
+                except Exception:
+                    data = None
+            if data is None or data.empty:
+                data = _load_legacy_min_cache(cache_path)
+            if data is None or data.empty:
+                if request_delay > 0:
+                    time.sleep(request_delay)
+                data = _fetch_min_data_remote(task.code, target_date_str, task.is_index, period, cache_path)
             if data is not None:
-                return {
-                    'code': task['code']
-                    , 'name': task['name']
-                    , 'data': data
-                    , 'turnover': task['to_val']
-                    , 'is_index': is_index
-                }
+                return _make_result(task, data)
         except Exception:
             pass
         return None
 
+    # 已有本地缓存的标的一次性批量读取，只有缺失的才进入线程池走网络
+    task_paths = [
+        _min_cache_path(t.code, target_date_str, period, t.is_index) for t in tasks
+    ]
+    cached = _read_min_cache_batch([p for p in task_paths if os.path.exists(p)])
+    pending = []
+    for t, path in zip(tasks, task_paths):
+        data = cached.get(path)
+        if data is not None and not data.empty:
+            results.append(_make_result(t, data))
+        else:
+            pending.append((t, path))
+    if cached:
+        log_info(f"分时缓存批量命中: {len(tasks) - len(pending)}/{len(tasks)}")
+
     ctx = get_script_run_ctx()
-    def _worker_wrapper(t):
-        if ctx:
-            add_script_run_ctx(threading.current_thread(), ctx)
-        return _worker(t)
 
     if max_workers <= 1:
-        for t in tasks:
-            res = _worker(t)
+        for t, path in pending:
+            res = _worker(t, path)
             if res:
                 results.append(res)
-    else:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_task = {executor.submit(_worker_wrapper, t): t for t in tasks}
+    elif pending:
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, initializer=_bind_script_run_ctx, initargs=(ctx,)
+        ) as executor:
+            future_to_task = {executor.submit(_worker, t, path): t for t, path in pending}
             
             for future in concurrent.futures.as_completed(future_to_task):
                 res = future.result()
@@ -663,3 +1372,100 @@ def fetch_intraday_data_v2(stock_codes, target_date_str, period='1', max_workers
                     results.append(res)
 
     return results
+
+
+def _intraday_bundle_path(date_str, period, stock_codes):
+    """同一天、同一周期、同一组标的的分时结果合并存成一个文件，文件名取标的代码的哈希。"""
+    codes = ",".join(sorted(str(c) for c, _, _ in stock_codes))
+    codes_hash = hashlib.md5(f"{period}|{codes}".encode()).hexdigest()[:12]
+    return os.path.join(MIN_CACHE_DIR, "bundles", str(period), str(date_str), f"{codes_hash}{_MIN_CACHE_SUFFIX}")
+
+
+def _write_intraday_bundle(path, results):
+    # item 区分结果序号：指数 000001 与个股 000001 代码相同，不能只按 code 切分
+    frames = [
+        res['data'][['time', 'pct_chg', 'close']].assign(
+            item=i, code=res['code'], name=res['name'],
+            turnover=float(res['turnover'] or 0), is_index=bool(res['is_index'])
+        )
+        for i, res in enumerate(results)
+    ]
+    _write_min_cache(path, pd.concat(frames, ignore_index=True))
+
+
+def _read_intraday_bundle(path):
+    """读取合并文件并按 code 拆回 fetch_intraday_data_v2 的结果格式 (每项都是新的 DataFrame)。"""
+    df = _read_min_cache(path)
+    items = df['item'].to_numpy()
+    # 写入时每个结果的行是连续的，按边界切分即可，不需要 groupby
+    bounds = np.flatnonzero(items[1:] != items[:-1]) + 1
+    results = []
+    for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(df)]):
+        first = df.iloc[start]
+        results.append({
+            'code': first['code'],
+            'name': first['name'],
+            'data': df.iloc[start:end][['time', 'pct_chg', 'close']].reset_index(drop=True),
+            'turnover': first['turnover'],
+            'is_index': bool(first['is_index'])
+        })
+    return results
+
+
+def fetch_intraday_day_bundle(stock_codes, target_date_str, period='1', max_workers=1, request_delay=0.0):
+    """
+    按天缓存整组分时结果：历史交易日的数据不会再变，命中时只读一个文件，
+    不再逐个标的查缓存或请求网络。当天数据仍走 fetch_intraday_data_v2。
+    只有全部标的 (含 3 个指数) 都取到时才落盘，避免把缺失结果固化下来。
+    """
+    is_past = pd.Timestamp(target_date_str).date() < datetime.now().date()
+    bundle_path = _intraday_bundle_path(target_date_str, period, stock_codes) if is_past else None
+    if bundle_path and os.path.exists(bundle_path):
+        try:
+            return _read_intraday_bundle(bundle_path)
+        except Exception as e:
+            log_info(f"分时合并缓存读取失败，改为逐个获取: {bundle_path} | {e}")
+
+    results = fetch_intraday_data_v2(
+        stock_codes, target_date_str, period=period, max_workers=max_workers, request_delay=request_delay
+    )
+    if bundle_path and results and len(results) == len(stock_codes) + 3:
+        try:
+            _write_intraday_bundle(bundle_path, results)
+        except Exception as e:
+            log_info(f"分时合并缓存写入失败: {bundle_path} | {e}")
+    return results
+
+
+_INTRADAY_DAY_WORKERS = 4
+
+
+def iter_intraday_days(stock_codes, date_strs, period='1', max_workers=1, request_delay=0.0):
+    """
+    多个交易日并发获取分时，按完成顺序产出 (date_str, results)。
+    总线程数不超过 max_workers：并发天数 x 每天线程数 <= max_workers，
+    max_workers <= 1 时逐天串行，侧边栏的线程数设置仍是实际的并发上限。
+    """
+    max_workers = max(1, int(max_workers))
+    day_workers = min(_INTRADAY_DAY_WORKERS, len(date_strs), max_workers)
+    if day_workers <= 1:
+        for d_str in date_strs:
+            yield d_str, fetch_intraday_day_bundle(stock_codes, d_str, period, max_workers, request_delay)
+        return
+    per_day_workers = max(1, max_workers // day_workers)
+    ctx = get_script_run_ctx()
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=day_workers,
+        initializer=_bind_script_run_ctx, initargs=(ctx,)
+    ) as executor:
+        futures = {
+            executor.submit(fetch_intraday_day_bundle, stock_codes, d_str, period, per_day_workers, request_delay): d_str
+            for d_str in date_strs
+        }
+        for future in concurrent.futures.as_completed(futures):
+            d_str = futures[future]
+            try:
+                yield d_str, future.result()
+            except Exception as e:
+                log_info(f"分时获取失败: {d_str} | {e}")
+                yield d_str, []
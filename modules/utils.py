@@ -1,7 +1,13 @@
+import random
 import time
 from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
 import threading
 
+import numpy as np
+import pandas as pd
+import requests
+
 # 尝试导入 Streamlit 上下文管理器
 try:
     from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
@@ -9,7 +15,7 @@ except ImportError:
     from streamlit.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 def with_retry(func, retries=3, delay=1.0, default=None):
-    """通用重试装饰器逻辑"""
+    """通用重试装饰器逻辑：优先按服务端 Retry-After 等待，否则以 delay 为基数做带抖动的指数退避"""
     for i in range(retries):
         try:
             return func()
@@ -17,7 +23,8 @@ def with_retry(func, retries=3, delay=1.0, default=None):
             if i == retries - 1:
                 print(f"Failed after {retries} retries: {e}")
                 return default
-            time.sleep(delay * (i + 1)) # 指数退避
+            retry_after = retry_after_seconds(e)
+            time.sleep(retry_after if retry_after is not None else backoff_delay(i, base=delay))
 
 def get_start_date(years_back=None, months_back=None, days_back=None):
     """计算起始日期，返回 YYYYMMDD 字符串。
@@ -35,3 +42,98 @@ def get_start_date(years_back=None, months_back=None, days_back=None):
         else:
             target = datetime.now() - timedelta(days=365 * years_back)
     return target.strftime("%Y%m%d")
+
+def slice_trading_day(df, day):
+    """
+    取出某个交易日的所有行。要求 df 已按 日期 升序排列，
+    用二分查找定位区间 (O(log N))，替代 df['日期'].dt.date == day 的逐行比较。
+    """
+    start = pd.Timestamp(day).normalize()
+    return slice_date_range(df, start, start + pd.Timedelta(days=1), inclusive_end=False)
+
+def slice_date_range(df, start, end, inclusive_end=True):
+    """
+    取出 [start, end] 区间内的所有行 (inclusive_end=False 时为 [start, end))。
+    同样依赖 日期 升序，二分定位后返回 iloc 视图，不生成布尔掩码也不复制。
+    """
+    dates = df['日期'].to_numpy()
+    bounds = [pd.Timestamp(start).to_datetime64(), pd.Timestamp(end).to_datetime64()]
+    lo = np.searchsorted(dates, bounds[0], side='left')
+    hi = np.searchsorted(dates, bounds[1], side='right' if inclusive_end else 'left')
+    return df.iloc[lo:hi]
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """带抖动的指数退避时长 (秒)：min(cap, base * 2**attempt) * U(0.5, 1.5)，避免多线程同步重试。"""
+    return min(cap, base * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+
+def retry_after_seconds(exc):
+    """从异常附带的 HTTP 响应中读取 Retry-After (秒数或 HTTP 日期)，没有则返回 None。"""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_transient_error(exc):
+    """
+    是否为值得退避重试的错误：网络连接/超时，或 HTTP 429 / 5xx。
+    代理配置错误、解析失败、代码无数据等重试也不会好转，返回 False。
+    """
+    if isinstance(exc, requests.exceptions.ProxyError):
+        return False
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError)):
+        return True
+    status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+class RateLimiter:
+    """
+    AIMD 自适应限流器。
+    - 并发上限 c_t：成功时加性增加 alpha，失败时乘以 beta；
+    - 服务端给出 Retry-After 时整体冷却到指定时间。
+    用法：wait_if_throttled() 获取名额，请求结束后 release(success, retry_after)；
+    success=None 表示与限流无关的失败，只归还名额，不调整并发上限。
+    """
+
+    def __init__(self, max_concurrency, min_concurrency=1, alpha=0.5, beta=0.5):
+        self._cond = threading.Condition()
+        self._max = max(1, max_concurrency)
+        self._min = max(1, min(min_concurrency, self._max))
+        self._limit = float(self._max)
+        self._alpha = alpha
+        self._beta = beta
+        self._active = 0
+        self._cooldown_until = 0.0
+
+    def wait_if_throttled(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wait = self._cooldown_until - now
+                if wait <= 0 and self._active < int(self._limit):
+                    self._active += 1
+                    return
+                self._cond.wait(timeout=wait if wait > 0 else None)
+
+    def release(self, success, retry_after=None):
+        with self._cond:
+            self._active = max(0, self._active - 1)
+            if success:
+                self._limit = min(self._max, self._limit + self._alpha)
+            elif success is not None:
+                self._limit = max(self._min, self._limit * self._beta)
+            if retry_after:
+                self._cooldown_until = max(self._cooldown_until, time.monotonic() + retry_after)
+            self._cond.notify_all()
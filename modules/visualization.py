@@ -4,13 +4,43 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 
+# 分时横轴的固定布局：每个交易日 240 个交易分钟 + 20 的间隔；时间以距午夜的分钟数计
+_TRADING_MINUTES = 240
+_DAY_SLOT = _TRADING_MINUTES + 20
+_MORNING_OPEN = 9 * 60 + 30
+_MORNING_CLOSE = 11 * 60 + 30
+_AFTERNOON_OPEN = 13 * 60
+_MORNING_MINUTES = _MORNING_CLOSE - _MORNING_OPEN
+
+# 大股票池 (如中证500/1000) 时限制前端图元数量：标的数超过 _LARGE_POOL_ROWS 时，
+# 热力图把成交额低于 _TREEMAP_TAIL_QUANTILE 分位的尾部合并成一格，散点图只给偏离最大的点加标签
+_LARGE_POOL_ROWS = 400
+_TREEMAP_TAIL_QUANTILE = 0.1
+_SCATTER_LABELS = 20
+
+# 分时叠加图的个股配色与指数配色，模块加载时生成一次
+_STOCK_COLORS = tuple(px.colors.qualitative.Alphabet + px.colors.qualitative.Dark24)
+_INDEX_COLORS = {'000300': 'black', '000001': '#d62728', '399001': '#1f77b4'}
+
 def plot_market_heatmap(daily_df):
     """
     绘制市场全景热力图
     """
     max_limit = 7
     min_limit = -7
-    
+
+    if len(daily_df) > _LARGE_POOL_ROWS:
+        # 成交额低于分位阈值的尾部标的合并成一个“其他”格子，涨跌幅按成交额加权
+        turnover = daily_df['成交额'].to_numpy(dtype=float)
+        is_small = turnover < np.nanquantile(turnover, _TREEMAP_TAIL_QUANTILE)
+        rest = daily_df[is_small]
+        rest_to = rest['成交额'].sum()
+        rest_chg = (rest['涨跌幅'] * rest['成交额']).sum() / rest_to if rest_to else rest['涨跌幅'].mean()
+        daily_df = pd.concat([
+            daily_df[~is_small],
+            pd.DataFrame({'名称': [f"其他 {len(rest)} 只"], '代码': ['-'], '收盘': [np.nan], '涨跌幅': [rest_chg], '成交额': [rest_to]})
+        ], ignore_index=True)
+
     fig = px.treemap(
         daily_df,
         path=['名称'],
@@ -45,16 +75,29 @@ def plot_deviation_scatter(div_df, strategy_mode):
     """
     if div_df.empty:
         return None
-        
+
+    # 大股票池只给偏离度绝对值最大的若干点显示名称，其余点的名称仍在悬停提示里
+    names = div_df['名称'].to_numpy(dtype=object)
+    if len(div_df) > _LARGE_POOL_ROWS:
+        dev = div_df['偏离度'].to_numpy(dtype=float)
+        top = np.argpartition(-np.abs(dev), _SCATTER_LABELS - 1)[:_SCATTER_LABELS]
+        labels = np.full(len(div_df), '', dtype=object)
+        labels[top] = names[top]
+    else:
+        labels = names
+    div_df = div_df.assign(标签=labels)
+
     fig_scatter = px.scatter(
         div_df,
         x='成交额(亿)',
         y='偏离度',
         color='偏离度',
-        text='名称',
+        text='标签',
         color_continuous_scale=['#00a65a', '#ffffff', '#dd4b39'],
         log_x=True,
-        hover_data=['代码', '区间涨跌幅'],
+        hover_name='名称',
+        hover_data={'代码': True, '区间涨跌幅': True, '标签': False},
+        render_mode='webgl',
         title=f"资金偏离度分布图 (X轴为成交额对数) - {strategy_mode}"
     )
     fig_scatter.update_traces(textposition='top center')
@@ -65,16 +108,14 @@ def plot_intraday_charts(all_intraday_data, days_list, daily_df, chart_mode):
     """
     绘制分时叠加图
     """
+    # 代码 -> 成交额 一次建表，避免每个标的对 daily_df 做整列比较
+    turnover_map = dict(zip(daily_df['代码'].astype(str).tolist(), daily_df['成交额'].tolist()))
     combined_series = {}
     
     for item in all_intraday_data:
         code = item['code']
         if code not in combined_series:
-            to_val = 0
-            if not item.get('is_index'):
-                matches = daily_df[daily_df['代码'] == code]
-                if not matches.empty:
-                    to_val = matches.iloc[0]['成交额']
+            to_val = 0 if item.get('is_index') else turnover_map.get(code, 0)
             
             combined_series[code] = {
                 'name': item['name'],
@@ -85,113 +126,123 @@ def plot_intraday_charts(all_intraday_data, days_list, daily_df, chart_mode):
             }
         combined_series[code]['dfs'].append(item['data']) # Ensure item['data'] has been pre-processed (columns: time, pct_chg, close, date_col)
     
-    x_tick_vals = []
-    x_tick_text = []
-
     # Prepare X Axis
-    for i, d_str in enumerate(days_list):
-        base_x = i * (240 + 20)
-        day_label = d_str[5:]
-        
-        if len(days_list) > 1:
-            x_tick_vals.append(base_x + 120) 
-            x_tick_text.append(day_label)
-        else:
-            x_tick_vals.append(base_x)
-            x_tick_text.append(f"{day_label}\n09:30")
-            x_tick_vals.append(base_x + 120)
-            x_tick_text.append("11:30/13:00")
-            x_tick_vals.append(base_x + 240)
-            x_tick_text.append("15:00")
+    if len(days_list) > 1:
+        # 多日：每天一个刻度，放在午间衔接处
+        x_tick_vals = np.arange(len(days_list)) * _DAY_SLOT + _MORNING_MINUTES
+        x_tick_text = [d_str[5:] for d_str in days_list]
+    else:
+        day_label = days_list[0][5:] if days_list else ""
+        x_tick_vals = [0, _MORNING_MINUTES, _TRADING_MINUTES]
+        x_tick_text = [f"{day_label}\n09:30", "11:30/13:00", "15:00"]
 
     # Process data for plotting
-    for code, info in combined_series.items():
-        if not info['dfs']: continue
-        try:
-            full_df = pd.concat(info['dfs']).sort_values(['date_col', 'time'])
-        except:
-             continue
-             
-        full_df['time_str'] = full_df['time'].dt.strftime("%H:%M:%S")
-        x_values = []
-        
-        for idx, row in full_df.iterrows():
-            d_str = row['date_col']
-            day_idx = days_list.index(d_str) if d_str in days_list else 0
-            t_obj = row['time']
-            mins_from_midnight = t_obj.hour * 60 + t_obj.minute
-            
-            if mins_from_midnight <= 690:
-                offset = mins_from_midnight - 570
-            else:
-                offset = 120 + (mins_from_midnight - 780)
-                
-            final_x = day_idx * (240 + 20) + offset
-            x_values.append(final_x)
-            
-        full_df['x_int'] = x_values
-        base_price = full_df['close'].iloc[0]
-        full_df['cumulative_pct'] = (full_df['close'] - base_price) / base_price * 100
-        info['plot_data'] = full_df
-
-    # Split into SH/SZ
-    idx_data = [v for k,v in combined_series.items() if v['is_index']]
-    stk_data = [v for k,v in combined_series.items() if not v['is_index']]
-    
-    sh_stocks = [v for v in stk_data if v['code'].startswith('6')]
-    sz_stocks = [v for v in stk_data if not v['code'].startswith('6')]
-    
-    sh_index = [v for v in idx_data if v['code'] in ['000001', '000300']]
-    sz_index = [v for v in idx_data if v['code'] in ['399001', '000300']]
+    # 所有标的共用一张 (标的数 x 横轴位置) 的二维网格，位置即 x_int；
+    # 各天数据按偏移直接写入所在行，写完后每行天然按时间有序，不再需要逐标的 concat / 排序
+    day_index_map = {d: i for i, d in enumerate(days_list)}
+    grid_size = max(1, len(days_list)) * _DAY_SLOT
+    series_list = list(combined_series.values())
+    close_grid = np.full((len(series_list), grid_size), np.nan)
+    time_grid = np.full((len(series_list), grid_size), np.datetime64('NaT'), dtype='datetime64[ns]')
+    for row, info in enumerate(series_list):
+        for day_df in info['dfs']:
+            if day_df.empty:
+                continue
+            t = day_df['time']
+            mins_from_midnight = t.dt.hour.to_numpy() * 60 + t.dt.minute.to_numpy()
+            # 横轴：每个交易日占 240 分钟 + 20 间隔，午休 11:30-13:00 折叠
+            offset = np.where(
+                mins_from_midnight <= _MORNING_CLOSE,
+                mins_from_midnight - _MORNING_OPEN,
+                _MORNING_MINUTES + (mins_from_midnight - _AFTERNOON_OPEN)
+            )
+            in_session = (offset >= 0) & (offset < _DAY_SLOT)
+            pos = day_index_map.get(day_df['date_col'].iat[0], 0) * _DAY_SLOT + offset[in_session]
+            close_grid[row, pos] = day_df['close'].to_numpy(dtype=np.float64)[in_session]
+            time_grid[row, pos] = t.to_numpy(dtype='datetime64[ns]')[in_session]
+
+    # 基准价 = 每行第一个有效收盘价；累计涨跌幅整张网格一次算完
+    has_data = ~np.isnan(close_grid)
+    base_price = close_grid[np.arange(len(series_list)), has_data.argmax(axis=1)]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # 窄类型：plotly 以二进制数组序列化到前端，字节数随 dtype 宽度减半
+        pct_grid = ((close_grid - base_price[:, None]) * (100.0 / base_price[:, None])).astype(np.float32)
+
+    for row, info in enumerate(series_list):
+        filled = np.flatnonzero(has_data[row])
+        if filled.size == 0:
+            continue
+        # 每个标的只保留三条连续的 numpy 数组，trace 直接引用，不再为每个标的构造 DataFrame
+        info['plot_data'] = {
+            'x_int': filled.astype(np.int32),
+            'cumulative_pct': pct_grid[row, filled],
+            'time': time_grid[row, filled]
+        }
+
+    # Split into SH/SZ (一次遍历；沪深300 作为基准同时出现在两张图中)
+    sh_stocks, sz_stocks, sh_index, sz_index = [], [], [], []
+    for v in combined_series.values():
+        if v['is_index']:
+            if v['code'] in ('000001', '000300'):
+                sh_index.append(v)
+            if v['code'] in ('399001', '000300'):
+                sz_index.append(v)
+        elif v['code'].startswith('6'):
+            sh_stocks.append(v)
+        else:
+            sz_stocks.append(v)
 
     def _create_fig(stocks, indices, title_suffix):
-        fig = go.Figure()
+        # 先收集所有 trace 再一次性构建 Figure，避免逐条 add_trace 的重复校验
+        traces = []
         
         # Stocks
         if stocks:
-            max_to = max([s['turnover'] for s in stocks]) if stocks else 1
-            min_to = min([s['turnover'] for s in stocks]) if stocks else 0
-            color_palette = px.colors.qualitative.Alphabet + px.colors.qualitative.Dark24
+            # 线宽按成交额线性映射到 [1, 4] (下限 1.5)，一次算出所有标的
+            turnover = np.array([s['turnover'] for s in stocks], dtype=float)
+            to_range = turnover.max() - turnover.min()
+            if to_range == 0:
+                widths = np.full(len(stocks), 2.0)
+            else:
+                widths = np.maximum(1.5, 1 + 3 * (turnover - turnover.min()) / to_range)
             
             for i, s in enumerate(stocks):
                 if 'plot_data' not in s: continue
                 
-                if max_to == min_to: width=2
-                else: width = 1 + 3*(s['turnover'] - min_to)/(max_to - min_to)
-                
                 df_p = s['plot_data']
-                color = color_palette[i % len(color_palette)]
                 
-                fig.add_trace(go.Scatter(
+                traces.append(go.Scattergl(
                     x=df_p['x_int'],
                     y=df_p['cumulative_pct'],
                     mode='lines',
                     name=s['name'],
-                    line=dict(width=max(1.5, width), color=color),
-                    hovertemplate=f"<b>{s['name']}</b><br>涨跌: %{{y:.2f}}%<br>时间: %{{customdata}}",
-                    customdata=df_p['date_col'] + ' ' + df_p['time_str']
+                    line=dict(width=float(widths[i]), color=_STOCK_COLORS[i % len(_STOCK_COLORS)]),
+                    # 时间直接以 datetime 传给前端，由 plotly 在浏览器端格式化
+                    hovertemplate=f"<b>{s['name']}</b><br>涨跌: %{{y:.2f}}%<br>时间: %{{customdata|%Y-%m-%d %H:%M:%S}}",
+                    customdata=df_p['time']
                 ))
 
         # Indices
-        idx_colors = {'000300': 'black', '000001': '#d62728', '399001': '#1f77b4'}
         for idx in indices:
             if 'plot_data' not in idx: continue
             df_p = idx['plot_data']
             c_code = idx.get('code', '000300')
             
-            fig.add_trace(go.Scatter(
+            traces.append(go.Scattergl(
                 x=df_p['x_int'],
                 y=df_p['cumulative_pct'],
                 mode='lines',
                 name=idx['name'],
-                line=dict(width=3, color=idx_colors.get(c_code, 'black')),
+                line=dict(width=3, color=_INDEX_COLORS.get(c_code, 'black')),
                 hovertemplate=f"<b>{idx['name']}</b><br>涨跌: %{{y:.2f}}%"
             ))
 
+        fig = go.Figure(data=traces)
+
         # Dividers
         if len(days_list) > 1:
             for i in range(1, len(days_list)):
-                boundary = i * (240 + 20) - 10
+                boundary = i * _DAY_SLOT - 10
                 fig.add_vline(x=boundary, line_width=1, line_dash="dash", line_color="gray")
 
         fig.update_layout(
@@ -0,0 +1,108 @@
+"""
+请求重试与限流的离线检查 (不访问网络)：
+只有网络/限频错误才收缩共享并发并退避重试，其他错误立即失败且不影响限流器。
+可直接运行，也可用 pytest 执行。
+"""
+import sys
+from pathlib import Path
+
+import requests
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from modules import data_loader
+from modules.utils import RateLimiter, is_transient_error
+
+
+def _http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(response=response)
+
+
+def test_is_transient_error():
+    assert is_transient_error(requests.ConnectionError())
+    assert is_transient_error(requests.ReadTimeout())
+    assert is_transient_error(TimeoutError())
+    assert is_transient_error(_http_error(429))
+    assert is_transient_error(_http_error(503))
+    assert not is_transient_error(_http_error(404))
+    assert not is_transient_error(requests.exceptions.ProxyError())
+    assert not is_transient_error(KeyError("时间"))
+    assert not is_transient_error(TypeError("'NoneType' object is not subscriptable"))
+
+
+def test_limiter_release():
+    limiter = RateLimiter(max_concurrency=4)
+    limiter.wait_if_throttled()
+    limiter.release(None)
+    assert limiter._limit == 4 and limiter._active == 0
+    limiter.wait_if_throttled()
+    limiter.release(False)
+    assert limiter._limit == 2 and limiter._active == 0
+    limiter.wait_if_throttled()
+    limiter.release(True)
+    assert limiter._limit == 2.5
+
+
+class _Patched:
+    """临时替换 akshare 分时接口、共享限流器、退避时长与停止标记。"""
+
+    def __init__(self, error, stop=False):
+        self.error = error
+        self.stop = stop
+        self.calls = 0
+        self.limiter = RateLimiter(max_concurrency=4)
+
+    def _raise(self, **kwargs):
+        self.calls += 1
+        raise self.error
+
+    def __enter__(self):
+        self.saved = (
+            data_loader.ak.stock_zh_a_hist_min_em, data_loader._INTRADAY_LIMITER,
+            data_loader.backoff_delay, data_loader._stop_requested
+        )
+        data_loader.ak.stock_zh_a_hist_min_em = self._raise
+        data_loader._INTRADAY_LIMITER = self.limiter
+        data_loader.backoff_delay = lambda attempt, **kwargs: 0
+        data_loader._stop_requested = lambda: self.stop
+        return self
+
+    def __exit__(self, *exc):
+        (
+            data_loader.ak.stock_zh_a_hist_min_em, data_loader._INTRADAY_LIMITER,
+            data_loader.backoff_delay, data_loader._stop_requested
+        ) = self.saved
+
+
+def _request():
+    return data_loader._request_min_data("000001", "2024-01-08 09:30:00", "2024-01-08 15:00:00", False, "1")
+
+
+def test_non_transient_error_fails_fast():
+    with _Patched(KeyError("时间")) as p:
+        assert _request() is None
+        assert p.calls == 1
+        assert p.limiter._limit == 4 and p.limiter._active == 0
+
+
+def test_transient_error_backs_off_and_retries():
+    with _Patched(requests.ConnectionError()) as p:
+        assert _request() is None
+        assert p.calls == 3
+        assert p.limiter._limit < 4 and p.limiter._active == 0
+
+
+def test_transient_error_stops_when_requested():
+    with _Patched(_http_error(429), stop=True) as p:
+        assert _request() is None
+        assert p.calls == 1
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"{name}: ok")
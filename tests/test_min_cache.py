@@ -0,0 +1,120 @@
+"""
+分时缓存的离线检查 (不访问网络)：批量读取按调用方给出的路径返回结果，
+批量扫描失败时逐个回退读取本地缓存，不去请求网络。
+可直接运行，也可用 pytest 执行。
+"""
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from modules import data_loader
+
+
+def _sample_frame(base):
+    return pd.DataFrame({
+        'time': pd.date_range("2024-01-08 09:30", periods=3, freq="min"),
+        'pct_chg': [0.0, base, base * 2],
+        'close': [10.0, 10.0 + base, 10.0 + base * 2],
+    })
+
+
+def _write_samples(root):
+    # 路径用 os.path.join 拼出，包含 os.sep，与 _min_cache_path 的构造方式一致
+    paths = [os.path.join(root, "min_cache", f"00000{i}_2024-01-08_1_stk.feather") for i in range(3)]
+    for i, path in enumerate(paths):
+        data_loader._write_min_cache(path, _sample_frame(i + 1.0))
+    return paths
+
+
+def test_batch_read_keys_match_input_paths():
+    root = tempfile.mkdtemp()
+    try:
+        data_loader.clear_min_memory_cache()
+        paths = _write_samples(root)
+        result = data_loader._read_min_cache_batch(paths)
+        assert sorted(result) == sorted(paths)
+        for i, path in enumerate(paths):
+            assert result[path]['pct_chg'].iloc[1] == i + 1.0
+        # 第二次读取走进程内缓存，键不变
+        assert sorted(data_loader._read_min_cache_batch(paths)) == sorted(paths)
+    finally:
+        data_loader.clear_min_memory_cache()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_batch_read_with_normalized_fragment_paths():
+    # 模拟 Windows：pyarrow 返回的 fragment.path 与调用方传入的路径写法不同
+    root = tempfile.mkdtemp()
+    real_dataset = data_loader.ds.dataset
+    try:
+        data_loader.clear_min_memory_cache()
+        paths = [
+            os.path.join(os.path.dirname(p), ".", os.path.basename(p)) for p in _write_samples(root)
+        ]
+        data_loader.ds.dataset = lambda source, **kw: real_dataset([os.path.normpath(p) for p in source], **kw)
+        result = data_loader._read_min_cache_batch(paths)
+        assert sorted(result) == sorted(paths)
+    finally:
+        data_loader.ds.dataset = real_dataset
+        data_loader.clear_min_memory_cache()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_batch_read_skips_missing_files():
+    root = tempfile.mkdtemp()
+    try:
+        data_loader.clear_min_memory_cache()
+        paths = _write_samples(root)
+        absent = os.path.join(root, "min_cache", "999999_2024-01-08_1_stk.feather")
+        result = data_loader._read_min_cache_batch(paths + [absent])
+        assert absent not in result
+        assert len(result) == len(paths)
+    finally:
+        data_loader.clear_min_memory_cache()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_worker_falls_back_to_local_cache_when_batch_scan_fails():
+    root = tempfile.mkdtemp()
+    saved = (data_loader.MIN_CACHE_DIR, data_loader._fetch_min_data_remote)
+    remote_calls = []
+    try:
+        data_loader.clear_min_memory_cache()
+        data_loader.MIN_CACHE_DIR = os.path.join(root, "min_cache")
+        codes = ["000001", "000002", "000003"]
+        for i, code in enumerate(codes):
+            data_loader._write_min_cache(
+                data_loader._min_cache_path(code, "2024-01-08", "1", False), _sample_frame(i + 1.0)
+            )
+        # 损坏的分片让整个批量扫描失败
+        with open(data_loader._min_cache_path("000004", "2024-01-08", "1", False), "wb") as f:
+            f.write(b"not a feather file")
+
+        def fake_remote(symbol, date_str, is_index, period, cache_path):
+            remote_calls.append(symbol)
+            return None
+
+        data_loader._fetch_min_data_remote = fake_remote
+        stock_codes = [(code, code, 1.0) for code in codes + ["000004"]]
+        results = data_loader.fetch_intraday_data_v2(stock_codes, "2024-01-08", max_workers=2)
+        assert sorted(r['code'] for r in results) == codes
+        # 只有没有可用缓存的标的 (三个指数 + 损坏的文件) 才走网络
+        assert sorted(remote_calls) == sorted(["000300", "000001", "399001", "000004"])
+    finally:
+        data_loader.MIN_CACHE_DIR, data_loader._fetch_min_data_remote = saved
+        data_loader.clear_min_memory_cache()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"{name}: ok")